@@ -0,0 +1,262 @@
+"""Atom8 Scrape - Media catalog
+
+A SQLite database recording every media item ever scraped: where it came
+from, its author, date, title or caption, content hash and where it is on
+disk. Items are indexed by the integration and target (subreddit, blog,
+account, topic, ...) they were scraped from, source, author, date and hash,
+and titles and captions are full-text searchable (FTS5), e.g.
+    SELECT path FROM items WHERE integration = 'reddit'
+        AND target = 'PixelArt' AND date >= '2020-02-01'
+    SELECT path FROM items_fts JOIN items ON items.id = items_fts.rowid
+        WHERE items_fts MATCH 'tileset'
+
+Each scrape adds its export directory when it finishes. Exports made before
+the catalog existed are added with import_exports(), which reads the
+manifest.jsonl or .meta files of many export directories in parallel.
+"""
+
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+
+from . import manifest
+
+DEFAULT_CATALOG_PATH = 'catalog.db'
+
+METADATA_EXTENSION = '.meta'
+
+# Columns filled from a manifest record or .meta file
+ITEM_COLUMNS = (
+    'path', 'filename', 'export_directory', 'url', 'integration', 'target',
+    'source', 'author', 'date', 'title', 'text', 'sha256', 'duplicate_of',
+)
+
+TABLE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    export_directory TEXT NOT NULL,
+    url TEXT,
+    integration TEXT,
+    target TEXT,
+    source TEXT,
+    author TEXT,
+    date TEXT,
+    title TEXT,
+    text TEXT,
+    sha256 TEXT,
+    duplicate_of TEXT
+);
+'''
+
+# Columns added since the first catalogs, see Catalog._migrate
+ADDED_COLUMNS = ('integration', 'target')
+
+INDEX_SCHEMA = '''
+CREATE INDEX IF NOT EXISTS items_target ON items (integration, target, date);
+CREATE INDEX IF NOT EXISTS items_source ON items (source);
+CREATE INDEX IF NOT EXISTS items_author ON items (author);
+CREATE INDEX IF NOT EXISTS items_date ON items (date);
+CREATE INDEX IF NOT EXISTS items_sha256 ON items (sha256);
+'''
+
+# Kept in step with items through triggers
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, text, content='items', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+    INSERT INTO items_fts (rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+END;
+'''
+
+UPSERT = '''
+INSERT INTO items ({columns}) VALUES ({values})
+ON CONFLICT (path) DO UPDATE SET {updates}
+'''.format(
+    columns=', '.join(ITEM_COLUMNS),
+    values=', '.join('?' * len(ITEM_COLUMNS)),
+    updates=', '.join(
+        '%s = excluded.%s' % (column, column)
+        for column in ITEM_COLUMNS if column != 'path'))
+
+# Catalog, loaded through load_catalog()
+catalog = None
+
+
+def read_export(export_directory):
+    """Read the items of an export directory.
+
+    Items come from its manifest.jsonl, or from its .meta files for exports
+    made before manifests.
+
+    Returns:
+        list: a tuple of ITEM_COLUMNS values per item.
+    """
+    export_directory = os.path.abspath(export_directory)
+    filenames = os.listdir(export_directory)
+
+    records = []
+    if manifest.MANIFEST_FILENAME in filenames:
+        with open(os.path.join(
+                export_directory, manifest.MANIFEST_FILENAME)) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        # The media file of each .meta shares its name, less the extension
+        media = {
+            os.path.splitext(filename)[0]: filename
+            for filename in filenames
+            if not filename.endswith(METADATA_EXTENSION)
+        }
+        for filename in filenames:
+            stem, ext = os.path.splitext(filename)
+            if ext == METADATA_EXTENSION and stem in media:
+                with open(os.path.join(export_directory, filename)) as f:
+                    records.append(dict(json.load(f), filename=media[stem]))
+
+    items = []
+    for record in records:
+        record = dict(
+            record,
+            path=os.path.join(export_directory, record['filename']),
+            export_directory=export_directory)
+        items.append(tuple(record.get(column) for column in ITEM_COLUMNS))
+    return items
+
+
+def find_exports(directory):
+    """Yield every directory below `directory`, itself included, holding a
+    manifest.jsonl or .meta files."""
+    for dirpath, _, filenames in os.walk(directory):
+        if any(filename == manifest.MANIFEST_FILENAME or
+               filename.endswith(METADATA_EXTENSION)
+               for filename in filenames):
+            yield dirpath
+
+
+class Catalog():
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        # Used by the runner and import threads, one at a time
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(TABLE_SCHEMA)
+        self._migrate()
+        self._connection.executescript(INDEX_SCHEMA)
+        try:
+            self._connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5
+            self.full_text = False
+
+    def add(self, items):
+        """Add or update items, tuples of ITEM_COLUMNS values."""
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT, items)
+
+    def add_export(self, export_directory):
+        """Add the items of an export directory, see read_export."""
+        items = read_export(export_directory)
+        self.add(items)
+        return len(items)
+
+    def search(self, query, limit=100):
+        """Return the items whose title or caption match an FTS5 query.
+
+        Returns:
+            list: a dict of ITEM_COLUMNS per item, best matches first.
+        """
+        if not self.full_text:
+            raise RuntimeError('SQLite was built without FTS5')
+
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT {} FROM items_fts JOIN items '
+                'ON items.id = items_fts.rowid WHERE items_fts MATCH ? '
+                'ORDER BY rank LIMIT ?'.format(', '.join(
+                    'items.' + column for column in ITEM_COLUMNS)),
+                (query, limit)).fetchall()
+        return [dict(zip(ITEM_COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _migrate(self):
+        # Add the columns missing from catalogs made before them
+        columns = {row[1] for row in self._connection.execute(
+            'PRAGMA table_info(items)')}
+        with self._connection:
+            for column in ADDED_COLUMNS:
+                if column not in columns:
+                    self._connection.execute(
+                        'ALTER TABLE items ADD COLUMN %s TEXT' % column)
+
+
+def import_exports(directories, path=DEFAULT_CATALOG_PATH, jobs=None,
+                   progress=None):
+    """Add every export found below some directories to a catalog.
+
+    Exports are read by `jobs` processes at once and written to the catalog
+    as they are read.
+
+    Args:
+        directories (list): directories searched with find_exports.
+
+        path (str): the catalog to add to.
+
+        jobs (int, optional): processes reading exports, one per CPU if
+            not given.
+
+        progress (callable, optional): called with (export directory,
+            item count) once an export is added.
+
+    Returns:
+        int: number of items added.
+    """
+    exports = [export for directory in directories
+               for export in find_exports(directory)]
+
+    target = Catalog(path)
+    total = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs) as executor:
+            for export, items in zip(
+                    exports, executor.map(read_export, exports)):
+                target.add(items)
+                total += len(items)
+                if progress is not None:
+                    progress(export, len(items))
+    finally:
+        target.close()
+
+    return total
+
+
+def get_catalog():
+    return catalog
+
+
+def load_catalog(path=DEFAULT_CATALOG_PATH):
+    """Open the catalog at a path and make it the shared catalog."""
+    global catalog
+
+    catalog = Catalog(path)
+    return catalog
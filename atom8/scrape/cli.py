@@ -4,9 +4,13 @@ A CLI tool used to operate Atom8 Scrape integrations. These integrations scrape
 images from the web to be processed by Atom8 Curate.
 """
 
+import os
+
 import click
 
-from . import etc, integrations
+from . import (
+    catalog, clock, download, etc, manifest, metrics, net, profiling,
+    ratelimit, runner, state, tracing, transport)
 
 
 def load_settings(ctx, path):
@@ -37,11 +41,45 @@ def vecho(ctx, message, **kwargs):
               help='specify export directory (desktop)')
 @click.option('-d', '--depth', default=3,
               help='number of days to scrape (3)')
+@click.option('-w', '--workers', default=None,
+              type=click.IntRange(min=1),
+              help='number of concurrent downloads (%d)'
+              % download.DEFAULT_WORKERS)
+@click.option('-q', '--queue-depth', default=None,
+              type=click.IntRange(min=1),
+              help='images found ahead of the downloads per source (%d)'
+              % download.DEFAULT_QUEUE_DEPTH)
+@click.option('-s', '--state', 'state_path', default=None,
+              help='file remembering the newest post of each source (%s)'
+              % state.DEFAULT_STATE_PATH)
+@click.option('--data-dir', 'data_directory', default=None,
+              type=click.Path(file_okay=False),
+              help='directory of the state, indexes, cache and catalog kept '
+              'between scrapes (the settings directory)')
+@click.option('--record', 'record_path', default=None,
+              help='record every HTTP exchange into an archive directory')
+@click.option('--replay', 'replay_path', default=None,
+              type=click.Path(exists=True, file_okay=False),
+              help='answer HTTP requests from a recorded archive')
+@click.option('--replay-latency', default=1.0,
+              help='scale of the recorded latency when replaying (1.0)')
+@click.option('-m', '--metrics', 'show_metrics', default=False, is_flag=True,
+              help='print request, download and timing metrics of the run')
+@click.option('--profile', default=False, is_flag=True,
+              help='profile the scrape, profiles are saved to the export')
+@click.option('--profile-memory', default=False, is_flag=True,
+              help='also track allocations while profiling')
+@click.option('--trace', default=False, is_flag=True,
+              help='save a timeline of the scrape to the export (%s)'
+              % tracing.TRACE_FILENAME)
 @click.argument('settings_path', nargs=1, type=click.Path(exists=True),
                 required=True)
 @click.argument('target', nargs=-1, required=True)
 @click.pass_context
-def main(ctx, verbose, exportdir, depth, settings_path, target):
+def main(ctx, verbose, exportdir, depth, workers, queue_depth, state_path,
+         data_directory, record_path, replay_path, replay_latency,
+         show_metrics, profile, profile_memory, trace, settings_path,
+         target):
     """atom8 - scrape
 
     Scrape from popular social media websites using various conditions and
@@ -51,6 +89,9 @@ def main(ctx, verbose, exportdir, depth, settings_path, target):
     # Verify context exists
     ctx.ensure_object(dict)
 
+    if record_path and replay_path:
+        ctx.fail("--record and --replay can not be used together")
+
     # Verbosity
     ctx.obj['verbose'] = verbose
 
@@ -72,6 +113,67 @@ def main(ctx, verbose, exportdir, depth, settings_path, target):
           fg='magenta')
     etc.create_directory(export_directory)
 
+    # Start the download engine, the flag takes priority over settings
+    all_settings = settings.get('all', {})
+    if workers is None:
+        workers = all_settings.get(
+            'download_workers', download.DEFAULT_WORKERS)
+    if queue_depth is None:
+        queue_depth = all_settings.get(
+            'download_queue_depth', download.DEFAULT_QUEUE_DEPTH)
+    engine = download.configure(
+        workers, queue_depth,
+        chunk_size=all_settings.get(
+            'download_chunk_size', etc.DOWNLOAD_CHUNK_SIZE),
+        max_size=all_settings.get(
+            'download_max_size', etc.MAX_DOWNLOAD_SIZE))
+    vecho(ctx, "Download workers: %d, queue depth: %d"
+          % (engine.workers, engine.queue_depth), fg='magenta')
+
+    # Keep at least one pooled connection per download worker
+    pool_size = max(engine.workers, all_settings.get(
+        'http_pool_size', net.DEFAULT_POOL_SIZE))
+
+    # Record or replay every HTTP exchange
+    adapter = None
+    if record_path:
+        vecho(ctx, "Recording HTTP to: %s" % record_path, fg='magenta')
+        adapter = transport.RecordingAdapter(
+            record_path, pool_connections=pool_size, pool_maxsize=pool_size)
+        clock.freeze(adapter.recorded_at)
+    elif replay_path:
+        vecho(ctx, "Replaying HTTP from: %s" % replay_path, fg='magenta')
+        adapter = transport.ReplayAdapter(replay_path, replay_latency)
+
+        # Scrape as of the recording, so the window matches it
+        if adapter.recorded_at is not None:
+            clock.freeze(adapter.recorded_at)
+            vecho(ctx, "Scraping as of: %s" % clock.now(), fg='magenta')
+
+    net.configure(
+        pool_size=pool_size,
+        timeout=all_settings.get('http_timeout', net.DEFAULT_TIMEOUT),
+        adapter=adapter)
+
+    # Requests to each host are paced by the integrations' rate limits
+    ratelimit.configure(
+        ratelimit.rules_from_settings(settings), max_concurrency=pool_size)
+
+    # Metadata goes to the export's manifest, and .meta files if enabled
+    manifest.configure(
+        all_settings.get('manifest_batch_size', manifest.DEFAULT_BATCH_SIZE),
+        all_settings.get('meta_sidecars', False))
+
+    # Stores kept between scrapes live beside the settings by default.
+    # Recorded and replayed scrapes make every request of a full scrape, so
+    # what previous scrapes have seen is not loaded.
+    if data_directory is None:
+        data_directory = os.path.dirname(os.path.abspath(settings_path))
+    vecho(ctx, "Data directory: %s" % data_directory, fg='magenta')
+    runner.load_stores(
+        settings, data_directory, previous_scrapes=adapter is None,
+        state_path=state_path)
+
     #
     # BEGIN SCRAPING
     #
@@ -82,29 +184,61 @@ def main(ctx, verbose, exportdir, depth, settings_path, target):
     if scrape_all:
         vecho(ctx, "Scraping all integrations", fg='yellow')
 
-    if 'instagram' in target or scrape_all:
-        vecho(ctx, '\nPerforming Instagram scrape', fg='yellow')
-        integrations.instagram.scrape(
-            settings['instagram']['profiles'], export_directory, days=depth)
-
-    if 'reddit' in target or scrape_all:
-        vecho(ctx, "\nPerforming Reddit scrape", fg='yellow')
-        integrations.reddit.scrape(
-            settings['reddit']['subreddits'], export_directory, days=depth)
+    names = [name for name in runner.INTEGRATIONS
+             if name in target or scrape_all]
+    vecho(ctx, "Performing scrapes: %s" % ', '.join(names), fg='yellow')
 
-    if 'tigsource' in target or scrape_all:
-        vecho(ctx, "\nPerforming TIGSource scrape", fg='yellow')
-        integrations.tigsource.scrape(
-            settings['tigsource']['topics'], export_directory, days=depth)
+    if profile or profile_memory:
+        profiling.start(
+            os.path.join(export_directory, profiling.PROFILE_DIRECTORY),
+            memory=profile_memory)
 
-    if 'tumblr' in target or scrape_all:
-        vecho(ctx, "\nPerforming Tumblr scrape", fg='yellow')
-        integrations.tumblr.scrape(
-            settings['tumblr']['blogs'], export_directory, days=depth)
+    if trace:
+        tracing.start(os.path.join(export_directory, tracing.TRACE_FILENAME))
 
-    if 'twitter' in target or scrape_all:
-        vecho(ctx, "\nPerforming Twitter scrape", fg='yellow')
-        integrations.twitter.scrape(
-            settings['twitter']['users'], export_directory, days=depth)
+    metrics.reset()
+    summaries = runner.run_integrations(
+        names, settings, export_directory, depth, verbose=verbose)
 
     vecho(ctx, "\nEND SCRAPE", fg='yellow')
+    runner.print_summary(summaries)
+
+    summary_path = profiling.stop()
+    if summary_path is not None:
+        click.secho("Profile summary: %s" % summary_path, fg='magenta')
+
+    trace_path = tracing.stop()
+    if trace_path is not None:
+        click.secho("Trace: %s" % trace_path, fg='magenta')
+
+    # Where the run's time went, saved beside the images
+    metrics.write_report(
+        os.path.join(export_directory, metrics.REPORT_FILENAME))
+    if show_metrics:
+        metrics.print_summary()
+
+
+@click.command()
+@click.option('-v', '--verbose', default=False, is_flag=True)
+@click.option('-c', '--catalog', 'catalog_path',
+              default=catalog.DEFAULT_CATALOG_PATH,
+              help='catalog to add to (%s)' % catalog.DEFAULT_CATALOG_PATH)
+@click.option('-j', '--jobs', default=None, type=int,
+              help='export directories read at once (one per CPU)')
+@click.argument('directories', nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=False))
+def import_exports(verbose, catalog_path, jobs, directories):
+    """atom8 - catalog import
+
+    Add the exports found in DIRECTORIES, and any directory below them, to
+    the media catalog.
+    """
+
+    def progress(export_directory, count):
+        if verbose:
+            click.echo('%6d  %s' % (count, export_directory))
+
+    total = catalog.import_exports(
+        directories, catalog_path, jobs=jobs, progress=progress)
+    click.secho('Cataloged %d items in %s' % (total, catalog_path),
+                fg='green')
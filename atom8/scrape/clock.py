@@ -0,0 +1,39 @@
+"""Atom8 Scrape - Scrape clock
+
+The time a scrape runs as of. Integrations measure their scrape window from
+it instead of reading the system clock, so it can be frozen: a recorded
+scrape freezes it when recording starts and a replay of the archive freezes
+it at that same time (see transport.py), which makes the replay see the same
+window and make the same requests.
+"""
+
+import datetime
+import time
+
+# Epoch seconds the clock is frozen at, None to follow the system clock
+frozen_at = None
+
+
+def freeze(timestamp):
+    """Run later scrapes as of `timestamp` (epoch seconds)."""
+    global frozen_at
+
+    frozen_at = timestamp
+
+
+def unfreeze():
+    global frozen_at
+
+    frozen_at = None
+
+
+def timestamp():
+    """Return the current scrape time in epoch seconds."""
+    if frozen_at is not None:
+        return frozen_at
+    return time.time()
+
+
+def now():
+    """Return the current scrape time as a local datetime."""
+    return datetime.datetime.fromtimestamp(timestamp())
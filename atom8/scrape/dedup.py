@@ -0,0 +1,108 @@
+"""Atom8 Scrape - Duplicate media store
+
+A persistent index of every downloaded file keyed by the SHA-256 of its bytes.
+When a download turns out to be a copy of a file already in the index (the
+same image cross-posted to several sources, or scraped again by a later run),
+the new copy is replaced by a hard link to the original, or removed and only
+referenced from its metadata.
+"""
+
+import os
+import threading
+
+from . import etc
+
+DEFAULT_INDEX_PATH = 'media_index.json'
+
+# How duplicates are stored
+#   link: hard link to the original file (falls back to reference)
+#   reference: no file, the metadata records the original under 'duplicate_of'
+DEDUP_MODES = ('link', 'reference')
+DEFAULT_DEDUP_MODE = 'link'
+
+# Media index, loaded through load_index()
+index = None
+
+
+class MediaIndex():
+
+    def __init__(self, path, mode=DEFAULT_DEDUP_MODE):
+        if mode not in DEDUP_MODES:
+            raise ValueError('Unknown dedup mode: %s' % mode)
+
+        self.path = path
+        self.mode = mode
+        self.files = {}
+        self._lock = threading.Lock()
+
+        try:
+            self.files = etc.retrieve_JSON(path)
+        except FileNotFoundError:
+            pass
+
+    def claim(self, digest, file_path):
+        """Record a file under its digest unless an original exists.
+
+        An original that has since been deleted from disk is replaced.
+
+        Returns:
+            str: path of the original file, or None if `file_path` is new.
+        """
+        file_path = os.path.abspath(file_path)
+
+        with self._lock:
+            original = self.files.get(digest)
+            if original is not None and original != file_path \
+                    and os.path.exists(original):
+                return original
+
+            self.files[digest] = file_path
+            return None
+
+    def save(self):
+        with self._lock:
+            etc.export_JSON(self.path, self.files)
+
+
+def get_index():
+    return index
+
+
+def load_index(path=DEFAULT_INDEX_PATH, mode=DEFAULT_DEDUP_MODE):
+    """Load the media index from a path and make it the shared index."""
+    global index
+
+    index = MediaIndex(path, mode)
+    return index
+
+
+def store_file(digest, file_path):
+    """Deduplicate a freshly downloaded file.
+
+    Does nothing if no index is loaded.
+
+    Args:
+        digest (str): SHA-256 hex digest of the file.
+
+        file_path (str): path the file was downloaded to.
+
+    Returns:
+        str: path of the original when the file was a duplicate, else None.
+    """
+    if index is None:
+        return None
+
+    original = index.claim(digest, file_path)
+    if original is None:
+        return None
+
+    os.remove(file_path)
+
+    if index.mode == 'link':
+        try:
+            os.link(original, file_path)
+        except OSError:
+            # e.g. the original is on another device, keep the reference
+            pass
+
+    return original
@@ -0,0 +1,230 @@
+"""Atom8 Scrape - Download engine
+
+A shared pool of download workers. Integrations submit their images to the
+engine instead of downloading them one at a time, then wait on the jobs they
+submitted to receive a result for each one.
+
+Integrations discover media lazily (as generators) and hand the generator to
+download_stream(), so downloads start as soon as the first item is found.
+Discovery is paused while `queue_depth` of its items are waiting to download.
+Items whose URL was downloaded by an earlier run are dropped before queueing.
+A failed download holds the watermark of the post it was found in, so the
+next run reaches it again.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import threading
+import time
+
+from . import etc, metrics, profiling, seen, state
+
+# Amount of downloads allowed to run at once
+DEFAULT_WORKERS = 8
+
+# Items a single stream may have queued or downloading before discovery waits
+DEFAULT_QUEUE_DEPTH = 64
+
+# A piece of media found by an integration. `filename` and `metadata` may be
+# None, see DownloadEngine.submit(). `post` is the (source, target, timestamp)
+# of the post the media was found in. Its source and target are recorded with
+# the metadata as "integration" and "target", and it is passed to
+# state.hold_watermark() if the download fails.
+MediaItem = collections.namedtuple(
+    'MediaItem', ['url', 'filename', 'metadata', 'post'], defaults=(None,))
+
+# Outcome of a single download job. `filename` is the name the image was saved
+# under and `error` describes why the download failed (None when ok).
+DownloadResult = collections.namedtuple(
+    'DownloadResult', ['url', 'filename', 'ok', 'error'])
+
+# Shared engine, created on first use or through configure()
+engine = None
+
+
+class DownloadEngine():
+
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 queue_depth=DEFAULT_QUEUE_DEPTH,
+                 chunk_size=etc.DOWNLOAD_CHUNK_SIZE,
+                 max_size=etc.MAX_DOWNLOAD_SIZE):
+        # Both need at least 1, a queue depth of 0 would never let an item
+        # through
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='atom8-download')
+
+    def submit(self, url, directory, filename=None, metadata=None):
+        """Queue an image for download.
+
+        Args:
+            url (str): The url of the image to download.
+
+            directory (str): The directory to download the image to.
+
+            filename (str, optional): The filename to save the image under.
+
+            metadata (dict, optional): Metadata saved beside the image.
+
+        Returns:
+            concurrent.futures.Future: resolves to a DownloadResult.
+        """
+        # Workers count their metrics toward the submitting integration
+        return self._executor.submit(
+            metrics.bind(self._download), url, directory, filename, metadata)
+
+    def wait(self, futures, message=None):
+        """Wait for submitted jobs to finish.
+
+        Args:
+            futures (list): futures returned by submit().
+
+            message (str, optional): if given, progress is printed as each
+                job completes.
+
+        Returns:
+            list: a DownloadResult per job, in submission order.
+        """
+        if message is not None:
+            total = len(futures)
+            done = 0
+            for _ in concurrent.futures.as_completed(futures):
+                done += 1
+                print("%s (%d/%d)" % (message, done, total))
+
+        return [future.result() for future in futures]
+
+    def download_stream(self, items, directory, message=None):
+        """Download media items while they are being discovered.
+
+        The items are pulled in the calling thread and submitted one at a
+        time. Once `queue_depth` items are pending the caller blocks until a
+        download finishes, which keeps discovery from running ahead of the
+        downloads.
+
+        Args:
+            items (iterable): MediaItems, usually a generator.
+
+            directory (str): The directory to download the images to.
+
+            message (str, optional): if given, progress is printed as each
+                job completes.
+
+        Returns:
+            list: a DownloadResult per queued item, in discovery order.
+                Items already in the seen URL index are skipped and have no
+                result.
+        """
+        slots = threading.BoundedSemaphore(self.queue_depth)
+        completed = itertools.count(1)
+
+        def on_done(future):
+            slots.release()
+            if message is not None:
+                # Called from worker threads, print the line in one write
+                print("%s (%d)\n" % (message, next(completed)), end='')
+
+        # Time spent finding items, waiting for a free slot, and waiting for
+        # the last downloads once every item is found
+        discovery = queue_wait = 0.0
+
+        queued = []
+        futures = []
+        items = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                item = next(items, None)
+                discovery += time.perf_counter() - start
+                if item is None:
+                    break
+
+                if seen.is_seen(item.url):
+                    continue
+
+                start = time.perf_counter()
+                slots.acquire()
+                queue_wait += time.perf_counter() - start
+
+                metadata = item.metadata
+                if item.post is not None:
+                    integration, target, _ = item.post
+                    metadata = dict(
+                        metadata or {}, integration=integration,
+                        target=str(target))
+
+                future = self.submit(
+                    item.url, directory, item.filename, metadata=metadata)
+                future.add_done_callback(on_done)
+                queued.append(item)
+                futures.append(future)
+        except BaseException:
+            # Drop the queued downloads and let the running ones finish, so
+            # they are recorded before the runner flushes the manifest and
+            # seen index
+            for future in futures:
+                future.cancel()
+            concurrent.futures.wait(futures)
+            raise
+
+        metrics.record_time('discovery', discovery)
+        metrics.record_time('queue_wait', queue_wait)
+        with metrics.timed('drain'):
+            results = self.wait(futures)
+
+        for item, result in zip(queued, results):
+            if not result.ok and item.post is not None:
+                state.hold_watermark(*item.post)
+
+        return results
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _download(self, url, directory, filename, metadata):
+        name = 'download-' + metrics.current_integration()
+        with metrics.timed('download'), profiling.profiled(name):
+            return self._download_item(url, directory, filename, metadata)
+
+    def _download_item(self, url, directory, filename, metadata):
+        try:
+            saved_as = etc.download_image_from_url(
+                url, directory, filename, metadata=metadata,
+                chunk_size=self.chunk_size, max_size=self.max_size)
+        except OSError as e:
+            return DownloadResult(url, filename, False, str(e))
+
+        if saved_as is None:
+            return DownloadResult(url, filename, False, 'download failed')
+
+        seen.mark_seen(url)
+        return DownloadResult(url, saved_as, True, None)
+
+
+def configure(workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH,
+              chunk_size=etc.DOWNLOAD_CHUNK_SIZE,
+              max_size=etc.MAX_DOWNLOAD_SIZE):
+    """Replace the shared engine with one using `workers` threads.
+
+    Downloads are read `chunk_size` bytes at a time and abandoned past
+    `max_size` bytes (0 for no limit).
+    """
+    global engine
+
+    if engine is not None:
+        engine.shutdown()
+    engine = DownloadEngine(workers, queue_depth, chunk_size, max_size)
+    return engine
+
+
+def get_engine():
+    """Return the shared engine, creating it with defaults if needed."""
+    global engine
+
+    if engine is None:
+        engine = DownloadEngine()
+    return engine
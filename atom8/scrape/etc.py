@@ -1,10 +1,99 @@
 import datetime
+import hashlib
 import json
 import os
 import sys
-import urllib
+import threading
 import time
 
+import requests
+
+from . import dedup, manifest, metrics, net, tracing
+
+# Bytes read from a response at a time while saving a download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Largest download kept, in bytes. 0 allows any size.
+MAX_DOWNLOAD_SIZE = 512 * 1024 * 1024
+
+# Content types of media. Other responses are only kept if their first bytes
+# match one of MEDIA_SIGNATURES.
+MEDIA_CONTENT_TYPES = ('image/', 'video/')
+
+# (offset, bytes) starting the media formats the integrations download
+MEDIA_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n'),
+    (0, b'\xff\xd8\xff'),            # JPEG
+    (0, b'GIF87a'),
+    (0, b'GIF89a'),
+    (8, b'WEBP'),                      # RIFF....WEBP
+    (4, b'ftyp'),                      # MP4, MOV
+    (0, b'\x1a\x45\xdf\xa3'),        # WebM, Matroska
+    (0, b'BM'),
+)
+
+# Times a failed download is tried again, and seconds before the first retry.
+# The wait doubles after every retry.
+DOWNLOAD_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+# Client error statuses worth retrying, server errors always are
+RETRY_STATUSES = (408, 416, 429)
+
+# Extension of downloads in progress
+PART_EXTENSION = '.part'
+
+# FilenameIndex per export directory, built the first time it is used.
+_filename_indexes = {}
+_filename_indexes_lock = threading.Lock()
+
+
+class RejectedDownloadError(OSError):
+    """A response that is not media, or larger than allowed."""
+
+
+class FilenameIndex():
+    """In-memory index of the filenames taken in a directory.
+
+    The directory is listed once when the index is built. After that every
+    reserved filename is recorded here, so finding a free name never touches
+    the filesystem. The next number to try is remembered for each requested
+    filename, so repeated collisions (e.g. 'image.png') do not rescan earlier
+    candidates.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._names = set(os.listdir(directory))
+        self._next_suffix = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, filename):
+        return filename in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def reserve(self, filename):
+        """Claim filename, appending a unique number to it if it is taken.
+
+        Returns:
+            str: the claimed filename.
+        """
+        base_filename, ext = os.path.splitext(filename)
+
+        with self._lock:
+            x = self._next_suffix.get(filename, 0)
+            candidate = filename if x == 0 else base_filename + str(x) + ext
+            while candidate in self._names:
+                x += 1
+                candidate = base_filename + str(x) + ext
+
+            self._next_suffix[filename] = x + 1
+            self._names.add(candidate)
+
+        return candidate
+
 
 def create_directory(directory_path):
     """Creates a directory."""
@@ -16,7 +105,9 @@ def create_directory(directory_path):
             raise OSError('Folder already exists')
 
 
-def download_image_from_url(url, directory, filename=None, metadata=None):
+def download_image_from_url(url, directory, filename=None, metadata=None,
+                            chunk_size=DOWNLOAD_CHUNK_SIZE,
+                            max_size=MAX_DOWNLOAD_SIZE):
     """Download an image from a URL.
 
     Args:
@@ -26,32 +117,47 @@ def download_image_from_url(url, directory, filename=None, metadata=None):
 
         filename (str, optional): The filename to save the image under. If no
             filename is specified then saved under url.
+
+        chunk_size (int, optional): bytes read from the response at a time.
+
+        max_size (int, optional): largest download kept, 0 for any size.
+
+    Returns:
+        str: the filename the image was saved under, or None if the download
+            failed.
     """
 
     if filename is None:
         filename = url.split('/')[-1]
 
-    # check if filename exists, if so: append a unique number to it
-    base_filename, ext = os.path.splitext(filename)
-    x = 0
-    while filename in os.listdir(directory):
-        x += 1
-        filename = base_filename + str(x) + ext
+    filename = reserve_filename(directory, filename)
 
     try:
-        urllib.request.urlretrieve(url, os.path.join(directory, filename))
-    except (OSError, urllib.error.HTTPError):
+        digest = save_url(url, os.path.join(directory, filename),
+                          chunk_size=chunk_size, max_size=max_size)
+    except RejectedDownloadError as e:
+        print('[ERROR] Skipped %s: %s' % (url, e))
+        filename = None
+    except OSError:
         print('[ERROR] Could not download: ' + url)
+        filename = None
+
+    # Replace copies of media downloaded before, keep a note of the original
+    if filename is not None:
+        with tracing.span('dedup', 'io'):
+            duplicate_of = dedup.store_file(
+                digest, os.path.join(directory, filename))
+
+        # Recorded for every download, a duplicate's file may be removed
+        metadata = dict(metadata or {}, sha256=digest)
+        if duplicate_of is not None:
+            metadata['duplicate_of'] = duplicate_of
 
-    # Save image metadata as a seperate file because PNG wanted to be a dink
-    # and not specify any standard for saving image metadata.. WHY, why would
-    # they allow this.
+    metrics.record_download(url, filename is not None)
 
-    if metadata is not None:
-        metadata_filename, _ = os.path.splitext(filename)
-        metadata_filename += '.meta'
-        export_JSON(
-            os.path.join(directory, metadata_filename), metadata)
+    # Metadata of every download goes to the export's manifest
+    if filename is not None:
+        manifest.record(directory, filename, url, metadata)
 
     return filename
 
@@ -74,6 +180,37 @@ def find_desktop():
         return os.getcwd()
 
 
+def get_filename_index(directory):
+    """Return the FilenameIndex for a directory, building it if needed."""
+    key = os.path.abspath(directory)
+
+    with _filename_indexes_lock:
+        index = _filename_indexes.get(key)
+        if index is None:
+            index = FilenameIndex(directory)
+            _filename_indexes[key] = index
+
+    return index
+
+
+def reserve_filename(directory, filename):
+    """Claim a filename in a directory that no other download is using.
+
+    If the filename is taken then a unique number is appended to it. Safe to
+    call from multiple download threads at once.
+
+    Args:
+        directory (str): The directory the file will be saved to.
+
+        filename (str): The preferred filename.
+
+    Returns:
+        str: the claimed filename.
+    """
+
+    return get_filename_index(directory).reserve(filename)
+
+
 def retrieve_JSON(filename):
     """Retrieve JSON file as dict.
 
@@ -99,6 +236,145 @@ def prepend_timestamp_directory(directory_path, prefix='export'):
     return os.path.join(directory_path, prefix + timestamp)
 
 
+def save_url(url, destination, chunk_size=DOWNLOAD_CHUNK_SIZE,
+             max_size=MAX_DOWNLOAD_SIZE):
+    """Download the body of a URL to a file through the shared session.
+
+    The body is written to `destination` + '.part' and renamed to the
+    destination once complete, so a file under its final name is always
+    whole. Failed attempts are retried DOWNLOAD_RETRIES times, waiting
+    RETRY_BACKOFF seconds doubled after every attempt, and resume where the
+    previous attempt stopped when the server accepts Range requests.
+
+    The body is read `chunk_size` bytes at a time. The download is abandoned
+    as soon as it grows past `max_size` bytes, or if its first chunk shows it
+    is not media (see check_media).
+
+    Returns:
+        str: SHA-256 hex digest of the downloaded bytes.
+
+    Raises:
+        RejectedDownloadError: if the body is not media or too large.
+
+        OSError: if the request fails or the file cannot be written.
+            requests.RequestException is a subclass of OSError.
+    """
+    part_path = destination + PART_EXTENSION
+
+    try:
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                digest = _save_part(url, part_path, chunk_size, max_size)
+                break
+            except requests.RequestException as e:
+                if attempt == DOWNLOAD_RETRIES or not _is_transient(e):
+                    raise
+            metrics.record_retry(url)
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+        os.replace(part_path, destination)
+    except OSError:
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return digest
+
+
+def _save_part(url, part_path, chunk_size, max_size):
+    """Download a URL into a .part file, resuming it if it has any bytes.
+
+    Returns:
+        str: SHA-256 hex digest of the whole file.
+    """
+    sha256 = hashlib.sha256()
+
+    offset = 0
+    if os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+
+    headers = {'Range': 'bytes=%d-' % offset} if offset else None
+
+    with net.get(url, stream=True, headers=headers) as response:
+        # Start over next attempt if the part no longer matches the file
+        if response.status_code == 416:
+            os.remove(part_path)
+        response.raise_for_status()
+
+        # The server may ignore the range and send the whole body
+        if offset and (response.status_code != 206 or _content_range_start(
+                response.headers.get('content-range')) != offset):
+            offset = 0
+
+        size = offset + int(response.headers.get('content-length') or 0)
+        if max_size and size > max_size:
+            raise RejectedDownloadError(
+                'larger than %d bytes (%d)' % (max_size, size))
+
+        if offset:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    sha256.update(chunk)
+
+        size = offset
+        try:
+            with tracing.span('write', 'io', path=part_path), \
+                    open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    # A resumed body was checked by the attempt that started
+                    # it
+                    if size == 0:
+                        check_media(
+                            response.headers.get('content-type'), chunk)
+
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise RejectedDownloadError(
+                            'larger than %d bytes' % max_size)
+
+                    sha256.update(chunk)
+                    f.write(chunk)
+        finally:
+            metrics.record_bytes(url, size - offset)
+
+    return sha256.hexdigest()
+
+
+def check_media(content_type, first_chunk):
+    """Check that a response is media from its type and first bytes.
+
+    Raises:
+        RejectedDownloadError: if it is not.
+    """
+    if content_type and content_type.lower().startswith(MEDIA_CONTENT_TYPES):
+        return
+
+    for offset, signature in MEDIA_SIGNATURES:
+        if first_chunk[offset:offset + len(signature)] == signature:
+            return
+
+    raise RejectedDownloadError(
+        'not media (%s)' % (content_type or 'no content type'))
+
+
+def _content_range_start(content_range):
+    # "bytes 1000-1999/2000" -> 1000
+    try:
+        return int(content_range.split()[1].split('-')[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _is_transient(error):
+    """Check if a failed request is worth retrying."""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code
+        return status in RETRY_STATUSES or status >= 500
+    return True
+
+
 def verbose_iter(lst, message):
     tot_length = len(lst)
     curr = 0
@@ -23,7 +23,8 @@ from datetime import datetime
 import tkinter as tk
 from tkinter import filedialog
 
-from atom8.scrape import etc, integrations
+from atom8.scrape import (
+    download, etc, manifest, metrics, net, profiling, ratelimit, runner)
 from atom8.scrape.config import load_config
 
 # App config
@@ -42,6 +43,9 @@ EXPORT_DIRECTORY = None
 # Amount of days to scrape
 SCRAPE_RANGE = 0
 
+# Profile the scrape, see profiling.py
+PROFILE_SCRAPE = False
+
 
 class Atom8ScrapeApp(tk.Frame):
 
@@ -223,6 +227,12 @@ class Atom8ScrapeApp(tk.Frame):
         perform_btn.config(command=self.request_scrape)
         perform_btn.pack(side='bottom', padx=10, pady=10)
 
+        # Profile the scrape into the export directory
+        self.profile_var = tk.IntVar()
+        tk.Checkbutton(
+            right_frame, text='Profile', variable=self.profile_var
+        ).pack(side='bottom')
+
         # Set sysout to output_textbox
         sys.stdout = StdoutRedirector(self.output)
 
@@ -266,6 +276,7 @@ class Atom8ScrapeApp(tk.Frame):
 
     def request_scrape(self):
         global EXPORT_DIRECTORY
+        global PROFILE_SCRAPE
         global REQUEST_SCRAPE
         global SCRAPE_RANGE
 
@@ -280,8 +291,9 @@ class Atom8ScrapeApp(tk.Frame):
                 # difference between then and now.
                 time_since_last = datetime.now() \
                     - datetime.strptime(last_scrape_on, '%Y-%m-%d')
-                # Sets the SCRAPE_RANGE to the time difference IN DAYS
-                SCRAPE_RANGE = time_since_last.days
+                # Covers the last scrape's whole day, the watermarks of
+                # each source stop paging where that scrape left off
+                SCRAPE_RANGE = time_since_last.days + 1
             else:
                 print("[ERROR] Please specify a valid time range.")
                 return
@@ -296,6 +308,7 @@ class Atom8ScrapeApp(tk.Frame):
                 return
 
         EXPORT_DIRECTORY = self.export_directory
+        PROFILE_SCRAPE = bool(self.profile_var.get())
         REQUEST_SCRAPE = True
 
     def open_insta_settings(self):
@@ -707,7 +720,8 @@ class ScrapeThreadWrapper():
                 REQUEST_SCRAPE = False
                 print('*** SCRAPE STARTING ***')
                 print('Scrape Range: %d days' % SCRAPE_RANGE)
-                result = perform_scrape(EXPORT_DIRECTORY, SCRAPE_RANGE)
+                result = perform_scrape(
+                    EXPORT_DIRECTORY, SCRAPE_RANGE, PROFILE_SCRAPE)
                 if result == 0:
                     print('*** SCRAPE COMPLETED ***')
                 else:
@@ -725,7 +739,7 @@ class StdoutRedirector(object):
         self.text_space.update()
 
 
-def perform_scrape(export_directory, days):
+def perform_scrape(export_directory, days, profile=False):
     if export_directory is None or not export_directory:
         print('[ERROR] Specify an export directory')
         return
@@ -735,7 +749,7 @@ def perform_scrape(export_directory, days):
               export_directory)
         return
 
-    timestamped_export_dir = etc.timestamp_directory(export_directory)
+    timestamped_export_dir = etc.prepend_timestamp_directory(export_directory)
 
     # Create an export directory
     try:
@@ -745,39 +759,58 @@ def perform_scrape(export_directory, days):
     except OSError:
         return
 
-    # Perform instagram scrape
-    if config.options['instagram']['enabled']:
-        integrations.instagram.scrape(
-            config.options['instagram']['profiles'], timestamped_export_dir,
-            days=days)
-
-    # Perform reddit scrape
-    if config.options['reddit']['enabled']:
-        print('Performing Reddit scrape')
-        integrations.reddit.scrape(
-            config.options['reddit']['subreddits'], timestamped_export_dir,
-            days=days)
-
-    # Perform tigsource scrape
-    if config.options['tigsource']['enabled']:
-        print('Performing TIGsource scrape')
-        integrations.tigsource.scrape(
-            config.options['tigsource']['topics'], timestamped_export_dir,
-            days=days)
-
-    # Perform tumblr scrape
-    if config.options['tumblr']['enabled']:
-        print('Performing tumblr scrape')
-        integrations.tumblr.scrape(
-            config.options['tumblr']['blogs'], timestamped_export_dir,
-            days=days)
-
-    # Perform twitter scrape
-    if config.options['twitter']['enabled']:
-        print('Performing Twitter scrape')
-        integrations.twitter.scrape(
-            config.options['twitter']['users'], timestamped_export_dir,
-            days=days)
+    engine = download.configure(
+        config.options['all'].get(
+            'download_workers', download.DEFAULT_WORKERS),
+        config.options['all'].get(
+            'download_queue_depth', download.DEFAULT_QUEUE_DEPTH),
+        chunk_size=config.options['all'].get(
+            'download_chunk_size', etc.DOWNLOAD_CHUNK_SIZE),
+        max_size=config.options['all'].get(
+            'download_max_size', etc.MAX_DOWNLOAD_SIZE))
+    pool_size = max(engine.workers, config.options['all'].get(
+        'http_pool_size', net.DEFAULT_POOL_SIZE))
+    net.configure(
+        pool_size=pool_size,
+        timeout=config.options['all'].get(
+            'http_timeout', net.DEFAULT_TIMEOUT))
+    ratelimit.configure(
+        ratelimit.rules_from_settings(config.options),
+        max_concurrency=pool_size)
+
+    manifest.configure(
+        config.options['all'].get(
+            'manifest_batch_size', manifest.DEFAULT_BATCH_SIZE),
+        config.options['all'].get('meta_sidecars', False))
+
+    # The state, indexes, cache and catalog live beside the options file
+    runner.load_stores(
+        config.options,
+        os.path.dirname(os.path.abspath(config.options_path)))
+
+    # Perform all enabled scrapes at once
+    names = [name for name in runner.INTEGRATIONS
+             if config.options[name]['enabled']]
+    print('Performing scrapes: %s' % ', '.join(names))
+
+    if profile:
+        profiling.start(os.path.join(
+            timestamped_export_dir, profiling.PROFILE_DIRECTORY))
+
+    metrics.reset()
+    summaries = runner.run_integrations(
+        names, config.options, timestamped_export_dir, days)
+    runner.print_summary(summaries)
+
+    summary_path = profiling.stop()
+    if summary_path is not None:
+        print('Profile summary: %s' % summary_path)
+    metrics.write_report(
+        os.path.join(timestamped_export_dir, metrics.REPORT_FILENAME))
+
+    # Only move the last scrape date forward if every scrape completed
+    if not all(summary.ok for summary in summaries):
+        return 1
 
     config.options['all']['last_scrape_date'] = str(datetime.now().date())
     config.save_options()
@@ -0,0 +1,204 @@
+"""Atom8 Scrape - HTTP listing cache
+
+An on-disk cache for listing pages (reddit listings, TIGSource topic pages).
+Bodies are stored with their ETag and Last-Modified headers, and later
+requests for the same URL are sent as conditional requests (If-None-Match /
+If-Modified-Since). A 304 Not Modified is answered from the cache, so
+unchanged pages are not downloaded again.
+
+Streamed listings, such as the tumblr read API, skip the cache (see
+net.get_listing).
+
+Entries younger than the TTL are served without contacting the server. The
+least recently used entries are evicted once the cache grows past its size
+limit.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_DIRECTORY = 'http_cache'
+
+# Seconds an entry is served without revalidating. 0 always revalidates.
+DEFAULT_TTL = 0
+
+# Bytes of bodies kept before the least recently used are evicted
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Response headers stored with an entry
+STORED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+# Listing cache, loaded through load_cache()
+cache = None
+
+
+class HTTPCache():
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # key -> (body size, last access), read once from disk
+        self._entries = {}
+        for filename in os.listdir(directory):
+            key, ext = os.path.splitext(filename)
+            if ext == '.body':
+                stat = os.stat(os.path.join(directory, filename))
+                self._entries[key] = (stat.st_size, stat.st_mtime)
+        self._size = sum(size for size, _ in self._entries.values())
+
+    def get(self, fetch, url, ttl=None, **kwargs):
+        """GET a URL, answering from the cache where possible.
+
+        Args:
+            fetch (callable): performs the request, called as
+                fetch(url, headers=..., **kwargs).
+
+            url (str): the URL to GET.
+
+            ttl (float, optional): overrides the cache TTL for this request.
+
+        Returns:
+            requests.Response
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        entry = self._load(key)
+
+        if entry is not None and time.time() - entry['stored_at'] < ttl:
+            return self._cached_response(key, entry, url)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if entry['headers'].get('etag'):
+                headers['If-None-Match'] = entry['headers']['etag']
+            if entry['headers'].get('last-modified'):
+                headers['If-Modified-Since'] = \
+                    entry['headers']['last-modified']
+
+        response = fetch(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            entry['stored_at'] = time.time()
+            self._write_meta(key, entry)
+            return self._cached_response(key, entry, url)
+
+        if response.ok:
+            self._store(key, response)
+
+        return response
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _body_path(self, key):
+        return os.path.join(self.directory, key + '.body')
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, entry):
+        with open(self._meta_path(key), 'w') as f:
+            json.dump(entry, f)
+
+    def _cached_response(self, key, entry, url):
+        try:
+            with open(self._body_path(key), 'rb') as f:
+                body = f.read()
+        except OSError:
+            body = b''
+
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], time.time())
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry.get('encoding')
+        response._content = body
+        response.raw = io.BytesIO(body)
+        return response
+
+    def _store(self, key, response):
+        body = response.content
+
+        # Keep the body readable as a stream for callers that parse .raw
+        response.raw = io.BytesIO(body)
+
+        entry = {
+            'url': response.url,
+            'stored_at': time.time(),
+            'encoding': response.encoding,
+            'headers': {
+                name: response.headers[name]
+                for name in STORED_HEADERS if name in response.headers
+            },
+        }
+
+        with self._lock:
+            with open(self._body_path(key), 'wb') as f:
+                f.write(body)
+            self._write_meta(key, entry)
+
+            previous_size, _ = self._entries.get(key, (0, 0))
+            self._entries[key] = (len(body), time.time())
+            self._size += len(body) - previous_size
+
+            self._evict()
+
+    def _evict(self):
+        if self._size <= self.max_size:
+            return
+
+        by_access = sorted(self._entries, key=lambda k: self._entries[k][1])
+        for key in by_access:
+            if self._size <= self.max_size:
+                break
+            self._remove(key)
+
+    def _remove(self, key):
+        size, _ = self._entries.pop(key)
+        self._size -= size
+        for path in (self._body_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def get_cache():
+    return cache
+
+
+def load_cache(directory=DEFAULT_CACHE_DIRECTORY, ttl=DEFAULT_TTL,
+               max_size=DEFAULT_MAX_SIZE):
+    """Open the listing cache in a directory and make it the shared cache."""
+    global cache
+
+    cache = HTTPCache(directory, ttl, max_size)
+    return cache
@@ -1,18 +1,20 @@
 import instaloader
-from datetime import datetime, timedelta
-from .. import etc
+from datetime import timedelta
+from .. import clock, download, etc, state
 
 
-def scrape(profiles, export_directory, days=7, verbose=True):
+def get_profile_posts(profiles, days=7, verbose=True):
+    '''
+    Yield a MediaItem for each post made by the profiles
+    '''
 
     L = instaloader.Instaloader()
 
-    expire_date = datetime.now() - timedelta(days=days)
+    expire_date = clock.now() - timedelta(days=days)
 
     if verbose:
         profiles = etc.verbose_iter(profiles, 'Scanning insta profiles')
 
-    pending_posts = []
     for profile in profiles:
         p = None
         try:
@@ -21,34 +23,43 @@ def scrape(profiles, export_directory, days=7, verbose=True):
             print("[WARN] Profile does not exist: '%s'." % profile)
             continue
 
+        # Newest post seen by the previous scrape, paging stops once reached
+        watermark = state.get_watermark('instagram', profile)
+
         posts = p.get_posts()
         for post in posts:
             if verbose:
                 print('.', end='')
 
-            if post.date > expire_date:
-                pending_posts.append(post)
-            else:
+            timestamp = post.date.timestamp()
+            state.update_watermark(
+                'instagram', profile, post.shortcode, timestamp)
+
+            if post.date <= expire_date or state.reached_watermark(
+                    watermark, post.shortcode, timestamp):
                 break
 
+            post_name = post.shortcode + '.jpg'
+
+            metadata = {
+                'author': post.owner_username,
+                'date': str(post.date),
+                'ref': post_name,
+                'source': 'http://instagram.com/p/' + post.shortcode,
+                'text': post.caption
+            }
+
+            yield download.MediaItem(
+                post.url, post_name, metadata,
+                ('instagram', profile, timestamp))
+
         if verbose:
             print('')
 
-    if verbose:
-        pending_posts = etc.verbose_iter(
-            pending_posts, 'Downloading insta photos')
-
-    for post in pending_posts:
-        post_name = post.shortcode + '.jpg'
-
-        metadata = {
-            'author': post.owner_username,
-            'date': str(post.date),
-            'ref': post_name,
-            'source': 'http://instagram.com/p/' + post.shortcode,
-            'text': post.caption
-        }
-
-        etc.download_image_from_url(
-            post.url, export_directory, post_name,
-            metadata=metadata)
+
+def scrape(profiles, export_directory, days=7, verbose=True):
+    posts = get_profile_posts(profiles, days=days, verbose=verbose)
+
+    message = 'Downloading insta photos' if verbose else None
+    return download.get_engine().download_stream(
+        posts, export_directory, message)
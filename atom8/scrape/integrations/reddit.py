@@ -1,121 +1,237 @@
+import collections
+import json
 import os
-import requests
-import time
-from datetime import datetime, timedelta
-from .. import etc
+from datetime import datetime
+from .. import clock, download, etc, metrics, net, state
+
+# Listings are decoded with orjson when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Posts per listing page, reddit serves at most 100
+REQUEST_COUNT = 100
+
+# Subreddits combined into one /r/a+b+c listing
+SUBREDDITS_PER_LISTING = 25
+
+# Reddit stops paging a listing after about 1000 posts. A combined listing
+# shares them between its subreddits, once it runs out before the scrape
+# window ends the unfinished subreddits are paged on their own.
+LISTING_LIMIT = 1000
+
+# Hours after it is posted that a post under its subreddit's min_karma holds
+# the watermark, so later runs can take it once its karma has grown. Posts
+# reaching min_karma after this are skipped.
+KARMA_GRACE_HOURS = 24
+
+# The fields of a listing child kept for each post
+Post = collections.namedtuple('Post', [
+    'name', 'subreddit', 'created', 'ups', 'author', 'title', 'domain',
+    'url', 'permalink',
+])
 
 
 def get_creation_date(reddit_post_created):
-    return datetime.fromtimestamp(
-                time.mktime(time.localtime(reddit_post_created)))
+    return datetime.fromtimestamp(reddit_post_created)
+
 
+def decode_listing(content):
+    '''
+    Decode a listing page into its posts and the id of the next page
 
-def download_images(posts, export_directory):
+    Only the Post fields of each child are kept, the rest of the listing
+    (previews, media embeds, ...) is dropped with the decoded page.
+    '''
+
+    if orjson is not None:
+        listing = orjson.loads(content)
+    else:
+        listing = json.loads(content)
+
+    data = listing['data']
+    posts = [
+        Post(*(child['data'][field] for field in Post._fields))
+        for child in data['children']
+    ]
+    return posts, data['after']
+
+
+def download_images(posts, export_directory, verbose=False):
+    message = 'Downloading reddit images' if verbose else None
+    return download.get_engine().download_stream(
+        iter_images(posts), export_directory, message)
+
+
+def iter_images(posts):
+    '''
+    Yield a MediaItem for each post
+    '''
     for post in posts:
-        try:
-            post_name = post['permalink'].split('/')[-2]
-            post_url = post['url']
-            post_domain = post['domain']
-
-            if post_domain == 'gfycat.com':
-                post_url = post_url[:8] + 'zippy.' + post_url[8:] + '.webm'
-            if post_url.endswith('gifv'):
-                post_url = post_url[:-4] + 'mp4'
-
-            _, extension = os.path.splitext(post_url)
-            if extension is not None:
-                post_name += extension
-
-            metadata = {
-                'author': post['author'],
-                'date': str(get_creation_date(post['created'])),
-                'ref': post_name,
-                'source': 'http://reddit.com' + post['permalink'],
-                'title': post['title'],
-            }
-
-            if extension is not None:
-                etc.download_image_from_url(post_url, export_directory,
-                                            post_name + extension,
-                                            metadata=metadata)
-            else:
-                etc.download_image_from_url(post_url, export_directory,
-                                            post_name, metadata=metadata)
-
-        except (FileNotFoundError, OSError):
-            pass
-
-
-def get_subreddit_posts(subreddit, min_karma, days=7, verbose=True):
+        post_name = post.permalink.split('/')[-2]
+        post_url = post.url
+        post_domain = post.domain
+
+        if post_domain == 'gfycat.com':
+            post_url = post_url[:8] + 'zippy.' + post_url[8:] + '.webm'
+        if post_url.endswith('gifv'):
+            post_url = post_url[:-4] + 'mp4'
+
+        _, extension = os.path.splitext(post_url)
+        if extension is not None:
+            post_name += extension
+
+        metadata = {
+            'author': post.author,
+            'date': str(get_creation_date(post.created)),
+            'ref': post_name,
+            'source': 'http://reddit.com' + post.permalink,
+            'title': post.title,
+        }
+
+        # A failed download holds the watermark of its subreddit
+        watermark_post = ('reddit', post.subreddit, post.created)
+
+        if extension is not None:
+            yield download.MediaItem(
+                post_url, post_name + extension, metadata, watermark_post)
+        else:
+            yield download.MediaItem(
+                post_url, post_name, metadata, watermark_post)
+
+
+def get_subreddit_posts(subreddits, days=7, verbose=True, after='',
+                        karma_grace_hours=KARMA_GRACE_HOURS):
     '''
-    Retrieve posts from a subreddit
+    Yield posts from several subreddits through one combined listing,
+    newest first
+
+    Args:
+        subreddits (dict): subreddit name -> minimum karma of its posts.
+
+        after (str, optional): name of the post the listing starts after.
+
+        karma_grace_hours (float, optional): see KARMA_GRACE_HOURS.
     '''
 
-    # Access reddit JSON api and retrieve posts
-    # sorted by date (newest first)
-    BASE_REQUEST = 'http://reddit.com/r/{}/new.json?sort=new&count=25'\
-                   .format(subreddit)
-    HEADERS = {'user-agent': 'Mozilla/5.0'}
+    # Access reddit JSON api and retrieve posts of all the subreddits
+    # sorted by date (newest first), as many per page as reddit allows
+    BASE_REQUEST = 'http://reddit.com/r/{}/new.json?sort=new&limit={}'\
+                   .format('+'.join(subreddits), REQUEST_COUNT)
 
-    # Use any timezone as long as we use the same when converting post UTC
-    expire_date = datetime.now() - timedelta(days=days)
+    # Post times are compared as epoch seconds
+    cutoff = clock.timestamp() - days * 24 * 60 * 60
 
-    # after changes pages BASE_REQUEST?after=xxx
-    # where 'xxx' is defined by the json returned from the last request
-    after = ''
+    # Posts under min_karma that are newer than this may still reach it
+    grace_cutoff = clock.timestamp() - karma_grace_hours * 60 * 60
+
+    # Listing children name their subreddit in reddit's casing
+    names = {subreddit.lower(): subreddit for subreddit in subreddits}
 
-    posts = []
+    # Newest post seen by the previous scrape of each subreddit. A subreddit
+    # is done once its watermark is reached, paging stops when all are.
+    watermarks = {
+        subreddit: state.get_watermark('reddit', subreddit)
+        for subreddit in subreddits
+    }
+    done = set()
 
+    # Last post read of each subreddit, and the posts read in all
+    last_read = {}
+    read = 0
+
+    # after changes pages BASE_REQUEST?after=xxx
+    # where 'xxx' is defined by the json returned from the last request
     processing = True
     while processing:
-        response = requests.get(BASE_REQUEST + '&after=' + after,
-                                headers=HEADERS)
-        sub_data = response.json()['data']
+        response = net.get_listing(BASE_REQUEST + '&after=' + after)
+        with metrics.timed('parse'):
+            posts, after = decode_listing(response.content)
+        read += len(posts)
 
-        for post in sub_data['children']:
+        for post in posts:
 
             if verbose:
                 print('.', end='')
 
-            post = post['data']
-            creation_date = get_creation_date(post['created'])
+            subreddit = names.get(post.subreddit.lower())
+            if subreddit is None or subreddit in done:
+                continue
 
-            if creation_date < expire_date:
+            # The listing is sorted by date, so every later post is older
+            if post.created < cutoff:
                 processing = False
                 break
-            elif post['ups'] < min_karma:
-                continue
-            else:
-                posts.append(post)
 
-        after = sub_data['after']
+            last_read[subreddit] = post.name
+            state.update_watermark(
+                'reddit', subreddit, post.name, post.created)
+
+            if state.reached_watermark(
+                    watermarks[subreddit], post.name, post.created):
+                done.add(subreddit)
+                if len(done) == len(subreddits):
+                    processing = False
+                    break
+            elif post.ups >= subreddits[subreddit]:
+                # Named as in the settings, the key of its watermark
+                yield post._replace(subreddit=subreddit)
+            elif post.created >= grace_cutoff:
+                # Its karma can still grow, the next run sees it again
+                state.hold_watermark('reddit', subreddit, post.created)
+
         if after == 'null' or after is None:
+            # Ran out of pages inside the scrape window, truncated if the
+            # listing limit was reached
+            if processing and read >= LISTING_LIMIT - REQUEST_COUNT:
+                unfinished = [subreddit for subreddit in subreddits
+                              if subreddit not in done]
+                if len(subreddits) > 1:
+                    for subreddit in unfinished:
+                        yield from get_subreddit_posts(
+                            {subreddit: subreddits[subreddit]},
+                            days=days,
+                            verbose=verbose,
+                            after=last_read.get(subreddit, ''),
+                            karma_grace_hours=karma_grace_hours)
+                else:
+                    print("[WARN] Listing of r/%s ends before the scrape "
+                          "window, older posts are missed."
+                          % unfinished[0])
             processing = False
 
     if verbose:
         print('')  # newline
 
-    return posts
 
-
-def scrape(subreddits, export_directory, days=7, verbose=True):
+def scrape(subreddits, export_directory, days=7, verbose=True,
+           batch_size=SUBREDDITS_PER_LISTING,
+           karma_grace_hours=KARMA_GRACE_HOURS):
     """Perform reddit scrape routine."""
 
+    # Subreddits are scanned batch_size at a time through combined listings
+    batches = [
+        collections.OrderedDict(
+            (subreddit['name'], subreddit['min_karma'])
+            for subreddit in subreddits[start:start + batch_size])
+        for start in range(0, len(subreddits), batch_size)
+    ]
+
     if verbose:
-        subreddits = etc.verbose_iter(subreddits, 'Scanning subreddits')
-
-    # Retrieve reddit posts
-    posts = []
-    for subreddit in subreddits:
-        posts += get_subreddit_posts(
-            subreddit=subreddit['name'],
-            min_karma=subreddit['min_karma'],
+        batches = etc.verbose_iter(batches, 'Scanning subreddits')
+
+    # Retrieve reddit posts, they are downloaded as they are found
+    posts = (
+        post
+        for batch in batches
+        for post in get_subreddit_posts(
+            batch,
             days=days,
-            verbose=verbose
+            verbose=verbose,
+            karma_grace_hours=karma_grace_hours
         )
+    )
 
     # Download files
-    if verbose:
-        posts = etc.verbose_iter(posts, 'Downloading reddit images')
-
-    download_images(posts, export_directory)
+    return download_images(posts, export_directory, verbose=verbose)
@@ -1,23 +1,222 @@
+import collections
+import concurrent.futures
+import functools
+import queue
 import re
+import threading
+import lxml.etree
 import lxml.html
-import requests
 from datetime import datetime, timedelta
-from .. import etc
+from .. import clock, download, etc, metrics, net, profiling, state
 
 
 MAX_POST_CAP = 2**16
 POST_STEP = 20
-DATE_REGEXP = re.compile(r'[A-Za-z]{3,9} [0-9]{1,2}, [0-9]{4}')
+DATE_REGEXP = re.compile(
+    r'([A-Za-z]{3,9} [0-9]{1,2}, [0-9]{4})'
+    r'(?:, ([0-9]{1,2}):([0-9]{2}):([0-9]{2}) ([AP]M))?')
+REPLY_REGEXP = re.compile(r'Reply #([0-9]+) on:')
 
+# Post headers and post bodies, in document order
+POST_PARTS_XPATH = lxml.etree.XPath(
+    '//div[@class="smalltext" or @class="post"]')
+SUBJECT_XPATH = lxml.etree.XPath('//td[@id="top_subject"]/text()')
 
-def download_images(d, export_folder):
-    for image_url in d:
-        etc.download_image_from_url(image_url, export_folder)
+# A post on a topic page. date is None for posts without a parsable date.
+Post = collections.namedtuple('Post', ['reply', 'date', 'images'])
+Page = collections.namedtuple('Page', ['subject', 'posts'])
 
+# Seconds a cached page is trusted before asking the forum again. Only the
+# last page of a topic receives new replies, earlier pages rarely change.
+ARCHIVED_PAGE_TTL = 7 * 24 * 60 * 60
 
-def get_posts_by_date(topic_num, days=7, verbose=True):
+# Pages of a topic requested at once while walking it backwards
+PAGE_WINDOW = 4
+
+# How the oldest page inside the scrape window is found
+#   linear: walk back a window of pages at a time until a page is too old
+#   binary: exponential then binary search over the page offsets, so only
+#           O(log n) pages outside the scrape window are requested
+SEARCH_MODES = ('linear', 'binary')
+DEFAULT_SEARCH_MODE = 'linear'
+
+# Topics scanned at once, and image urls they may find ahead of the downloads
+TOPIC_WORKERS = 4
+TOPIC_QUEUE_SIZE = 256
+
+# Seconds a scan waits on a full image queue before checking if the images
+# are still wanted
+TOPIC_PUT_TIMEOUT = 0.5
+
+# Marks a topic scan as finished in the image queue
+_TOPIC_DONE = object()
+
+
+def download_images(d, export_folder, verbose=False):
+    message = 'Download TIGforum images' if verbose else None
+    return download.get_engine().download_stream(d, export_folder, message)
+
+
+def get_page(base_request, post_num, ttl=None):
+    response = net.get_listing(base_request + str(post_num), ttl=ttl)
+    return parse_page(response.content)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_day(day):
+    '''
+    Parse the day of a header date, e.g. "February 29, 2020"
+
+    Cached, a page's posts mostly share a few days.
+    '''
+
+    return datetime.strptime(day, '%B %d, %Y')
+
+
+def parse_date(raw_date):
     '''
-    Retrieve posts from a thread
+    Parse a post header date, None if it has none
+
+    Header dates look like "February 29, 2020, 09:12:44 PM". Posts from today
+    are shown as "Today at ..." and have no date.
+    '''
+
+    date_match = DATE_REGEXP.search(raw_date)
+    if not date_match:
+        return None
+
+    day, hour, minute, second, meridiem = date_match.groups()
+    date = parse_day(day)
+    if hour is None:
+        return date
+
+    # 12 AM is midnight and 12 PM noon
+    hour = int(hour) % 12
+    if meridiem == 'PM':
+        hour += 12
+    return date + timedelta(
+        hours=hour, minutes=int(minute), seconds=int(second))
+
+
+def parse_page(content):
+    '''
+    Parse a topic page into its subject and posts
+
+    The post headers and bodies are visited in one pass, in document order.
+    A header starts a new post and the body after it fills in its images.
+    Images repeated on the page, e.g. by quotes, are only kept once.
+
+    Returns:
+        Page
+    '''
+
+    with metrics.timed('parse'):
+        return _parse_page(content)
+
+
+def _parse_page(content):
+    tree = lxml.html.fromstring(content)
+
+    posts = []
+    seen_images = set()
+    reply = date = None
+    for div in POST_PARTS_XPATH(tree):
+        if div.get('class') == 'smalltext':
+            header = div.find('b')
+            if header is None or not header.text or \
+                    not header.text.endswith('on:'):
+                # Author details share the class
+                continue
+
+            # The opening post has no reply number
+            reply_match = REPLY_REGEXP.search(header.text)
+            reply = int(reply_match.group(1)) if reply_match else 0
+            date = parse_date(header.tail or '')
+
+        elif reply is not None:
+            images = []
+            for image in div.iterchildren('img'):
+                src = image.get('src')
+                if src and src not in seen_images:
+                    seen_images.add(src)
+                    images.append(src)
+
+            posts.append(Post(reply, date, images))
+            reply = date = None
+
+    subject = SUBJECT_XPATH(tree)
+    return Page(subject[0] if subject else None, posts)
+
+
+def page_in_window(page, expire_date):
+    '''
+    Check if any post on a page is newer than expire_date
+    '''
+
+    return any(post.date is None or post.date >= expire_date
+               for post in page.posts)
+
+
+def find_first_page(get_page_num, last_page, lowest_page, expire_date):
+    '''
+    Find the oldest page holding a post newer than expire_date
+
+    Post dates grow with the page number, so pages are probed going back
+    from the last page in doubling steps until one is entirely older than
+    expire_date, then the boundary is binary searched between the two.
+
+    Args:
+        get_page_num (callable): returns the parsed page for a page number.
+
+        last_page (int): page number of the last page, known to be inside
+            the window.
+
+        lowest_page (int): oldest page number that may be returned.
+
+    Returns:
+        int: the page number.
+    '''
+
+    def in_window(page_num):
+        return page_in_window(get_page_num(page_num), expire_date)
+
+    newest_outside = lowest_page - 1
+    oldest_inside = last_page
+
+    step = 1
+    while last_page - step > newest_outside:
+        page_num = last_page - step
+        if in_window(page_num):
+            oldest_inside = page_num
+            step *= 2
+        else:
+            newest_outside = page_num
+            break
+
+    while oldest_inside - newest_outside > 1:
+        page_num = (oldest_inside + newest_outside) // 2
+        if in_window(page_num):
+            oldest_inside = page_num
+        else:
+            newest_outside = page_num
+
+    return oldest_inside
+
+
+def get_posts_by_date(topic_num, days=7, verbose=True, window=PAGE_WINDOW,
+                      search=DEFAULT_SEARCH_MODE):
+    '''
+    Yield a MediaItem for each image of a thread, a page at a time
+
+    After the last page, earlier pages are requested `window` at a time. In
+    linear search the scan stops after the first window holding a page past
+    the expire date. In binary search the oldest page inside the window is
+    found first (see find_first_page) and only the pages after it are
+    requested.
+
+    Only images of posts newer than the expire date and the watermark are
+    yielded, and each image only once. Their metadata holds the topic, its
+    subject and the date of the post.
     '''
 
     # BASE_REQUEST + POST_CAP - 20x
@@ -26,64 +225,176 @@ def get_posts_by_date(topic_num, days=7, verbose=True):
                    .format(topic_num)
 
     # Use any timezone as long as we use the same when converting post UTC
-    expire_date = datetime.now() - timedelta(days=days)
+    expire_date = clock.now() - timedelta(days=days)
 
-    # Initial scan
-    response = requests.get(BASE_REQUEST + str(MAX_POST_CAP))
-    tree = lxml.html.fromstring(response.content)
+    # Initial scan, a post num past the end shows the last page
+    page = get_page(BASE_REQUEST, MAX_POST_CAP)
 
-    subject = tree.xpath('//td[@id="top_subject"]/text()')
+    subject = page.subject
     if verbose:
         print(subject)
 
-    # Calculate the max post num
-    reply_nums = tree.xpath('//div[@class="smalltext"]/b/text()')
-    post_num = MAX_POST_CAP
-    for reply_num in reply_nums:
-        if re.search(r'Reply #[0-9]+ on:', reply_num):
-            current_post_num = int(re.findall(r'\d+', reply_num)[0])
-            post_num = min(post_num, current_post_num)
+    # Topic without posts
+    if not page.posts:
+        return
 
-    processing = True
-    images = []
-    while processing:
-        response = requests.get(BASE_REQUEST + str(post_num))
-        tree = lxml.html.fromstring(response.content)
+    # Reply numbers of the last page
+    post_num = min(post.reply for post in page.posts)
+    newest_reply = max(post.reply for post in page.posts)
+
+    # Reply numbers only grow, so the newest reply seen by the previous scrape
+    # marks where paging can stop
+    watermark = state.get_watermark('tigsource', topic_num)
+    if watermark is not None and newest_reply <= watermark['id']:
+        return
+
+    dates = [post.date for post in page.posts if post.date is not None]
+    if dates:
+        state.update_watermark(
+            'tigsource', topic_num, newest_reply, max(dates).timestamp())
+
+    seen_images = set()
+
+    # Watermarks are reply numbers, a failed image keeps its topic's
+    # watermark where it is
+    watermark_post = ('tigsource', topic_num, None)
 
-        # Parse unicode date from post header and check if processing
-        dates = tree.xpath('//div[@class="smalltext"]/text()')
-        for raw_date in dates:
-            date_match = DATE_REGEXP.search(raw_date)
-            if date_match:
-                date = datetime.strptime(date_match.group(0), "%B %d, %Y")
+    def post_metadata(post):
+        # Posts from today have no date
+        return {
+            'date': str(post.date) if post.date is not None else None,
+            'source': BASE_REQUEST + str(post.reply),
+            'title': subject,
+            'topic': topic_num,
+        }
 
-                if date < expire_date:
-                    processing = False
+    def scan_page(page):
+        '''
+        Return MediaItems for the new images of a page and whether it reaches
+        past the expire date or the watermark
+        '''
 
-        images += tree.xpath('//div[@class="post"]/img/@src')
-        post_num -= POST_STEP
+        images = []
+        done = False
+        for post in page.posts:
+            if (post.date is not None and post.date < expire_date) or \
+                    (watermark is not None and post.reply <= watermark['id']):
+                done = True
+                continue
 
-    return images
+            for image in post.images:
+                if image not in seen_images:
+                    seen_images.add(image)
+                    images.append(download.MediaItem(
+                        image, None, post_metadata(post), watermark_post))
 
+        return images, done
 
-def get_topic_images(t, days=7, verbose=False):
-    out = []
-    for topic in t:
-        out += get_posts_by_date(topic, days, verbose)
-    return out
+    # The initial scan already fetched the last page
+    images, done = scan_page(page)
+    yield from images
+    if done:
+        return
 
+    # Page numbers are post nums divided by POST_STEP
+    lowest_page = 0
+    if watermark is not None:
+        lowest_page = watermark['id'] // POST_STEP
+    last_page = post_num // POST_STEP
 
-def scrape(topics, export_directory, days=7, verbose=False):
+    probed = {}
+
+    def get_page_num(page_num):
+        with profiling.profiled('tigsource'):
+            if page_num not in probed:
+                probed[page_num] = get_page(
+                    BASE_REQUEST, page_num * POST_STEP, ttl=ARCHIVED_PAGE_TTL)
+            return probed[page_num]
+
+    if search == 'binary':
+        first_page = find_first_page(
+            get_page_num, last_page, lowest_page, expire_date)
+    else:
+        first_page = lowest_page
+
+    earlier_pages = list(range(last_page - 1, first_page - 1, -1))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=window) as pool:
+        for start in range(0, len(earlier_pages), window):
+            pages = pool.map(metrics.bind(get_page_num),
+                             earlier_pages[start:start + window])
+
+            for page in pages:
+                images, done = scan_page(page)
+                yield from images
+                if done:
+                    return
+
+
+def get_topic_images(t, days=7, verbose=False, workers=TOPIC_WORKERS,
+                     search=DEFAULT_SEARCH_MODE):
+    '''
+    Yield the MediaItems of several threads, scanning `workers` at once
+    '''
+
+    images = queue.Queue(maxsize=TOPIC_QUEUE_SIZE)
+
+    # Set when this generator is closed before every topic is scanned
+    stopped = threading.Event()
+
+    def put(found):
+        # False once nothing reads the queue anymore
+        while not stopped.is_set():
+            try:
+                images.put(found, timeout=TOPIC_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_topic(topic):
+        try:
+            with profiling.profiled('tigsource'):
+                for image in get_posts_by_date(
+                        topic, days, verbose, search=search):
+                    if not put(image):
+                        return
+        finally:
+            put(_TOPIC_DONE)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        scans = [pool.submit(metrics.bind(scan_topic), topic) for topic in t]
+
+        try:
+            remaining = len(scans)
+            while remaining:
+                found = images.get()
+                if found is _TOPIC_DONE:
+                    remaining -= 1
+                else:
+                    yield found
+        finally:
+            # Scans blocked on a full queue stop, so the pool can shut down
+            stopped.set()
+
+    # Raise the error of any topic that failed
+    for scan in scans:
+        scan.result()
+
+
+def scrape(topics, export_directory, days=7, verbose=False,
+           search=DEFAULT_SEARCH_MODE):
     """Perform tigsource scrape routine."""
 
+    if search not in SEARCH_MODES:
+        raise ValueError('Unknown TIGSource search mode: %s' % search)
+
     images = []
     if verbose:
         images = get_topic_images(
             etc.verbose_iter(topics, 'Scanning TIGforum topics'),
-            days=days, verbose=verbose)
-        download_images(
-            etc.verbose_iter(images, 'Download TIGforum images'),
-            export_directory)
+            days=days, verbose=verbose, search=search)
     else:
-        images = get_topic_images(topics)
-        download_images(images, export_directory)
+        images = get_topic_images(topics, days=days, search=search)
+
+    return download_images(images, export_directory, verbose=verbose)
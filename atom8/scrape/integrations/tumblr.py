@@ -1,98 +1,148 @@
 import os
-import requests
-from bs4 import BeautifulSoup
+import lxml.etree
 from datetime import datetime, timedelta
-from .. import etc
+from .. import clock, download, etc, net, state
 
-# Provides access to tumblr blog and returns 25 of photo posts starting from
-# a variable index.
-REQUEST_COUNT = 25
+# Provides access to tumblr blog and returns up to `num` photo posts starting
+# from a variable index. The read API serves at most 50 posts per request.
+REQUEST_COUNT = 50
+MAX_REQUEST_COUNT = 50
 BASE_TUMBLR_REQUEST = \
-    'http://{0}.tumblr.com/api/read?type=photo&num=' + str(REQUEST_COUNT) + \
-    '&start={1}'
+    'http://{0}.tumblr.com/api/read?type=photo&num={1}&start={2}'
 
 
-def retrieve_tumblr_blog_photo_posts(tumblr_blog, days=7, verbose=True):
+def get_photo_urls(post):
     '''
-    Retrive posts from a tumblr blog
+    Return the largest url of every photo in a post
+
+    Photosets list each of their photos, other posts only have the
+    photo-url elements of the post itself. The largest size comes first.
     '''
 
-    expire_date = datetime.now() - timedelta(days=days)
+    photoset = post.find('photoset')
+    if photoset is not None:
+        return [photo.findtext('photo-url') for photo in photoset
+                if photo.findtext('photo-url')]
+
+    photo_url = post.findtext('photo-url')
+    return [photo_url] if photo_url else []
+
+
+def iter_posts(response):
+    '''
+    Yield the post elements of a read API response as they are parsed
+
+    Each post is cleared once the next one is requested, so only one post is
+    held in memory at a time.
+    '''
+
+    # Undo any gzip transfer encoding when reading the raw stream
+    response.raw.decode_content = True
+
+    for _, post in lxml.etree.iterparse(
+            response.raw, events=('end',), tag='post'):
+        yield post
+
+        post.clear()
+        while post.getprevious() is not None:
+            del post.getparent()[0]
+
+
+def retrieve_tumblr_blog_photo_posts(tumblr_blog, days=7, verbose=True,
+                                     page_size=REQUEST_COUNT):
+    '''
+    Yield a MediaItem for each photo posted to a tumblr blog, newest first
+    '''
+
+    expire_date = clock.now() - timedelta(days=days)
+    page_size = min(page_size, MAX_REQUEST_COUNT)
+
+    # Newest post seen by the previous scrape, paging stops once reached
+    watermark = state.get_watermark('tumblr', tumblr_blog)
 
     start = 0
-    image_URLs = []
 
     processing = True
     while processing:
-        req = BASE_TUMBLR_REQUEST.format(tumblr_blog, start)
-        response = requests.get(req)
+        req = BASE_TUMBLR_REQUEST.format(tumblr_blog, page_size, start)
+        response = net.get_listing(req, stream=True)
 
         if not response.ok:
             if verbose:
                 print("[ERROR] Bad response (" + req + ")")
-            processing = False
+            response.close()
             break
 
-        tumblr_data = BeautifulSoup(response.text, 'lxml')
-        tumblr_posts = tumblr_data.find_all('post')
+        post_count = 0
+        try:
+            for post in iter_posts(response):
+                post_count += 1
+
+                if verbose:
+                    print('.', end='')
+
+                # ignore if post was before expire date
+                posted_on = datetime.strptime(
+                    post.get('date'),
+                    '%a, %d %b %Y %H:%M:%S')
+                timestamp = float(post.get('unix-timestamp'))
+                state.update_watermark(
+                    'tumblr', tumblr_blog, post.get('id'), timestamp)
+
+                if posted_on < expire_date or state.reached_watermark(
+                        watermark, post.get('id'), timestamp):
+                    processing = False
+                    break
+
+                # caption
+                caption = post.findtext('photo-caption', '')
+
+                # ignore anything without a photo-url
+                for n, photo_url in enumerate(get_photo_urls(post)):
+                    _, ext = os.path.splitext(photo_url)
+                    ref = post.get('id') + ext
+                    if n:
+                        ref = '%s_%d%s' % (post.get('id'), n, ext)
+
+                    post_info = {
+                        'author': tumblr_blog,
+                        'date': str(posted_on),
+                        'ref': ref,
+                        'source': photo_url,
+                        'text': caption
+                    }
+                    yield download.MediaItem(
+                        photo_url, ref, post_info,
+                        ('tumblr', tumblr_blog, timestamp))
+        except lxml.etree.XMLSyntaxError:
+            if verbose:
+                print("[ERROR] Bad response (" + req + ")")
+            processing = False
+        finally:
+            response.close()
 
-        for post in tumblr_posts:
+        # A short page is the last one
+        if post_count < page_size:
+            processing = False
 
-            if verbose:
-                print('.', end='')
-
-            # ignore if post was before expire date
-            posted_on = datetime.strptime(
-                post['date'],
-                '%a, %d %b %Y %H:%M:%S')
-            if posted_on < expire_date:
-                processing = False
-                break
-
-            # caption
-            caption = post.find('photo-caption')
-            if caption is not None:
-                caption = caption.text
-            else:
-                caption = ''
-
-            # ignore anything without a photo-url
-            photo_url = post.find('photo-url')
-            if photo_url is None:
-                continue
-
-            _, ext = os.path.splitext(photo_url.text)
-            post_info = {
-                'author': tumblr_blog,
-                'date': str(posted_on),
-                'ref': post['id'] + ext,
-                'source': photo_url.text,
-                'text': caption
-            }
-            image_URLs.append(post_info)
-
-        start += REQUEST_COUNT
+        start += page_size
 
     if verbose:
         print('')
 
-    return image_URLs
 
-
-def scrape(tumblr_blogs, export_directory, days=7, verbose=True):
+def scrape(tumblr_blogs, export_directory, days=7, verbose=True,
+           page_size=REQUEST_COUNT):
     if verbose:
         tumblr_blogs = etc.verbose_iter(tumblr_blogs, 'Scanning tumblr blogs')
 
-    tumblr_posts = []
-    for tumblr_blog in tumblr_blogs:
-        tumblr_posts += retrieve_tumblr_blog_photo_posts(
-            tumblr_blog, days=days, verbose=verbose)
-
-    if verbose:
-        tumblr_posts = etc.verbose_iter(
-            tumblr_posts, 'Downloading tumblr images')
+    images = (
+        image
+        for tumblr_blog in tumblr_blogs
+        for image in retrieve_tumblr_blog_photo_posts(
+            tumblr_blog, days=days, verbose=verbose, page_size=page_size)
+    )
 
-    for tumblr_post in tumblr_posts:
-        etc.download_image_from_url(
-            tumblr_post['source'], export_directory, tumblr_post['ref'],
-            metadata=tumblr_post)
+    message = 'Downloading tumblr images' if verbose else None
+    return download.get_engine().download_stream(
+        images, export_directory, message)
@@ -1,18 +1,23 @@
 import twitter_scraper
-from datetime import datetime, timedelta
-from .. import etc
+from datetime import timedelta
+from .. import clock, download, etc, state
 
 
-def scrape(users, export_directory, days=7, verbose=True):
+def get_user_photos(users, days=7, verbose=True):
+    '''
+    Yield a MediaItem for each photo tweeted by the users
+    '''
 
-    expire_date = datetime.now() - timedelta(days=days)
+    expire_date = clock.now() - timedelta(days=days)
 
     if verbose:
         users = etc.verbose_iter(users, 'Scanning twitter feeds')
 
-    photos = []
     for user in users:
 
+        # Newest tweet seen by the previous scrape, paging stops once reached
+        watermark = state.get_watermark('twitter', user)
+
         # Don't exit on the first tweet because it could be a pinned tweet and
         # that messes up the time comparisons
         first_tweet = True
@@ -22,7 +27,14 @@ def scrape(users, export_directory, days=7, verbose=True):
                 print('.', end='')  # An indicator for each tweet read
 
             tweet_time = tweet.get('time')
-            if tweet_time > expire_date:
+            tweet_id = tweet.get('tweetId')
+            timestamp = tweet_time.timestamp()
+            state.update_watermark('twitter', user, tweet_id, timestamp)
+
+            if state.reached_watermark(watermark, tweet_id, timestamp):
+                if not first_tweet:
+                    break
+            elif tweet_time > expire_date:
                 tweet_photos = tweet.get('entries').get('photos')
 
                 if tweet_photos:
@@ -37,7 +49,9 @@ def scrape(users, export_directory, days=7, verbose=True):
                             'text': tweet['text']
                         }
 
-                        photos.append(meta)
+                        yield download.MediaItem(
+                            photo_url, photo_name, meta,
+                            ('twitter', user, timestamp))
 
             elif not first_tweet:
                 break
@@ -46,9 +60,10 @@ def scrape(users, export_directory, days=7, verbose=True):
         if verbose:
             print('')  # newline
 
-    if verbose:
-        photos = etc.verbose_iter(photos, 'Downloading twitter images')
 
-    for photo_meta in photos:
-        etc.download_image_from_url(photo_meta['source'], export_directory,
-                                    photo_meta['ref'], metadata=photo_meta)
+def scrape(users, export_directory, days=7, verbose=True):
+    photos = get_user_photos(users, days=days, verbose=verbose)
+
+    message = 'Downloading twitter images' if verbose else None
+    return download.get_engine().download_stream(
+        photos, export_directory, message)
@@ -0,0 +1,125 @@
+"""Atom8 Scrape - Export manifest
+
+Metadata of every download in an export directory is appended to a single
+JSON lines file, manifest.jsonl, instead of a .meta file beside each image.
+Records are buffered and written `batch_size` at a time; flush() writes what
+is left at the end of a scrape.
+
+Each record holds the filename, the url it was downloaded from and the
+metadata given by the integration, e.g.
+    {"filename": "5wh3w7.gif", "url": "https://i.redd.it/8jw1ah1lxeiy.gif",
+     "author": "speckz", "sha256": "...", ...}
+
+Older versions of Curate read .meta sidecars, which are still written when
+`sidecars` is enabled.
+"""
+
+import json
+import os
+import threading
+
+from . import etc, tracing
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+# Records buffered before they are appended to the manifest
+DEFAULT_BATCH_SIZE = 100
+
+# Manifest per export directory, created the first time it is used
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+records_per_batch = DEFAULT_BATCH_SIZE
+write_sidecars = False
+
+
+class Manifest():
+
+    def __init__(self, directory, batch_size=DEFAULT_BATCH_SIZE,
+                 sidecars=False):
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.sidecars = sidecars
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def add(self, filename, url, metadata=None):
+        """Record a download, writing the batch once it is full."""
+        record = {'filename': filename, 'url': url}
+        if metadata:
+            record.update(metadata)
+        line = json.dumps(record) + '\n'
+
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) >= self.batch_size:
+                self._write()
+
+        if self.sidecars and metadata is not None:
+            self._write_sidecar(filename, metadata)
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if self._lines:
+            with tracing.span('manifest', 'io', records=len(self._lines)), \
+                    open(self.path, 'a') as f:
+                f.writelines(self._lines)
+            self._lines = []
+
+    def _write_sidecar(self, filename, metadata):
+        # Save image metadata as a seperate file because PNG wanted to be a
+        # dink and not specify any standard for saving image metadata.. WHY,
+        # why would they allow this.
+        metadata_filename, _ = os.path.splitext(filename)
+        metadata_filename += '.meta'
+        with tracing.span('sidecar', 'io'):
+            etc.export_JSON(
+                os.path.join(self.directory, metadata_filename), metadata)
+
+
+def configure(batch_size=DEFAULT_BATCH_SIZE, sidecars=False):
+    """Set how the manifests of later scrapes are written.
+
+    Args:
+        batch_size (int): records buffered before they are written.
+
+        sidecars (bool): also write a .meta file beside each download.
+    """
+    global _manifests, records_per_batch, write_sidecars
+
+    flush()
+    with _manifests_lock:
+        records_per_batch = batch_size
+        write_sidecars = sidecars
+        _manifests = {}
+
+
+def get_manifest(directory):
+    """Return the Manifest of an export directory, creating it if needed."""
+    key = os.path.abspath(directory)
+
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = Manifest(directory, records_per_batch, write_sidecars)
+            _manifests[key] = manifest
+
+    return manifest
+
+
+def record(directory, filename, url, metadata=None):
+    """Record a download in the manifest of its export directory."""
+    get_manifest(directory).add(filename, url, metadata)
+
+
+def flush():
+    """Write the buffered records of every manifest."""
+    with _manifests_lock:
+        manifests = list(_manifests.values())
+
+    for manifest in manifests:
+        manifest.flush()
@@ -0,0 +1,287 @@
+"""Atom8 Scrape - Run metrics
+
+Counts and timings of a scrape, collected per integration and per host:
+    - requests, their latency and status codes, and retries
+    - listing requests and their latency, including cache hits
+    - downloads, failures and bytes received
+    - time spent parsing listings, discovering media, waiting on the
+      download queue and downloading
+
+Records are attributed to the integration running in the current thread (see
+integration() and bind()). Latencies are kept as histograms of LATENCY_BUCKETS.
+
+write_report() saves the collected metrics as JSON, print_summary() prints
+them as a table.
+"""
+
+import bisect
+import collections
+import contextlib
+import json
+import threading
+import time
+import urllib.parse
+
+from . import tracing
+
+REPORT_FILENAME = 'metrics.json'
+
+# Upper bounds, in seconds, of the latency histogram buckets. Slower samples
+# fall in a last, unbounded bucket.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30)
+
+# Integration name of records made outside of any integration
+NO_INTEGRATION = 'none'
+
+_context = threading.local()
+
+
+class Histogram():
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the pth percentile."""
+        if not self.count:
+            return None
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ['inf'],
+                self.buckets)),
+        }
+
+
+class HostMetrics():
+
+    def __init__(self):
+        self.requests = Histogram()
+        self.listings = Histogram()
+        self.statuses = collections.Counter()
+        self.errors = 0
+        self.retries = 0
+        self.downloads = 0
+        self.failures = 0
+        self.bytes = 0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests.to_dict(),
+            'listings': self.listings.to_dict(),
+            'statuses': {str(status): count
+                         for status, count in sorted(self.statuses.items())},
+            'errors': self.errors,
+            'retries': self.retries,
+            'downloads': self.downloads,
+            'failures': self.failures,
+            'bytes': self.bytes,
+        }
+
+
+class Metrics():
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        # integration -> host -> HostMetrics
+        self._hosts = collections.defaultdict(
+            lambda: collections.defaultdict(HostMetrics))
+
+        # integration -> timing name -> Histogram
+        self._timings = collections.defaultdict(
+            lambda: collections.defaultdict(Histogram))
+
+    def host(self, url):
+        """Return the HostMetrics of a url for the current integration.
+
+        Only use the result while holding `lock`.
+        """
+        host = urllib.parse.urlsplit(url).hostname or ''
+        return self._hosts[current_integration()][host]
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self._timings[current_integration()][name].add(seconds)
+
+    def to_dict(self):
+        with self.lock:
+            integrations = sorted(set(self._hosts) | set(self._timings))
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'integrations': {
+                    name: {
+                        'timings': {
+                            timing: histogram.to_dict()
+                            for timing, histogram in sorted(
+                                self._timings[name].items())
+                        },
+                        'hosts': {
+                            host: host_metrics.to_dict()
+                            for host, host_metrics in sorted(
+                                self._hosts[name].items())
+                        },
+                    }
+                    for name in integrations
+                },
+            }
+
+
+# Shared collector, replaced through reset()
+collector = Metrics()
+
+
+def reset():
+    """Start collecting a new run."""
+    global collector
+
+    collector = Metrics()
+    return collector
+
+
+def current_integration():
+    return getattr(_context, 'integration', NO_INTEGRATION)
+
+
+@contextlib.contextmanager
+def integration(name):
+    """Attribute the records made by this thread to an integration."""
+    previous = current_integration()
+    _context.integration = name
+    try:
+        yield
+    finally:
+        _context.integration = previous
+
+
+def bind(function):
+    """Wrap a function to run under the current thread's integration.
+
+    Used for work handed to other threads, e.g. executor jobs.
+    """
+    name = current_integration()
+
+    def bound(*args, **kwargs):
+        with integration(name):
+            return function(*args, **kwargs)
+
+    return bound
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Add the time spent in a block to the timing `name`.
+
+    The block is also traced as a span of the same name.
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.span(name, current_integration()):
+            yield
+    finally:
+        collector.add_time(name, time.perf_counter() - start)
+
+
+def record_time(name, seconds):
+    collector.add_time(name, seconds)
+
+
+def record_request(url, seconds, status=None):
+    """Record a request, `status` None if it failed without a response."""
+    with collector.lock:
+        host = collector.host(url)
+        host.requests.add(seconds)
+        if status is None:
+            host.errors += 1
+        else:
+            host.statuses[status] += 1
+
+
+def record_listing(url, seconds):
+    """Record a listing request, answered by the host or the cache."""
+    with collector.lock:
+        collector.host(url).listings.add(seconds)
+
+
+def record_retry(url):
+    with collector.lock:
+        collector.host(url).retries += 1
+
+
+def record_bytes(url, count):
+    """Record bytes of a download received."""
+    with collector.lock:
+        collector.host(url).bytes += count
+
+
+def record_download(url, ok):
+    with collector.lock:
+        host = collector.host(url)
+        if ok:
+            host.downloads += 1
+        else:
+            host.failures += 1
+
+
+def write_report(path):
+    """Save the collected metrics as JSON."""
+    with open(path, 'w') as f:
+        json.dump(collector.to_dict(), f, indent=4)
+
+
+def print_summary():
+    """Print a table of the collected metrics."""
+    report = collector.to_dict()
+
+    print('\nRUN METRICS (%.1fs)' % report['elapsed'])
+    for name, integration_report in report['integrations'].items():
+        timings = ', '.join(
+            '%s %.2fs' % (timing, histogram['total'])
+            for timing, histogram in integration_report['timings'].items())
+        print('%s%s' % (name, '  (' + timings + ')' if timings else ''))
+
+        print('    %-28s %6s %8s %8s %6s %6s %6s %9s' % (
+            'host', 'reqs', 'p50', 'p90', 'dl', 'fail', 'retry', 'MB'))
+        for host, host_report in integration_report['hosts'].items():
+            requests = host_report['requests']
+            print('    %-28s %6d %8s %8s %6d %6d %6d %9.2f' % (
+                host[:28], requests['count'],
+                _format_seconds(requests['p50']),
+                _format_seconds(requests['p90']),
+                host_report['downloads'], host_report['failures'],
+                host_report['retries'], host_report['bytes'] / 2**20))
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return '<%gs' % seconds
@@ -0,0 +1,183 @@
+"""Atom8 Scrape - HTTP client
+
+A single requests session shared by every integration and the download
+engine. Connections are kept alive in a pool per host, so pagination loops and
+batches of downloads from the same host reuse them instead of opening a new
+TCP/TLS connection for every request.
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import httpcache, metrics, ratelimit, tracing
+
+# Connections kept open per host. Should be at least the number of download
+# workers, otherwise connections are discarded instead of reused.
+DEFAULT_POOL_SIZE = 10
+
+# Seconds to wait when connecting or between bytes received
+DEFAULT_TIMEOUT = 30
+
+# Sent with every request. reddit rejects the default requests user-agent.
+DEFAULT_HEADERS = {'user-agent': 'Mozilla/5.0'}
+
+# Times a request answered 429/503 is sent again, after the host's pause
+OVERLOAD_RETRIES = 3
+
+# Shared session, created on first use or through configure()
+session = None
+request_timeout = DEFAULT_TIMEOUT
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, headers=None, adapter=None):
+    """Create a session with a connection pool of `pool_size` per host.
+
+    A transport adapter (see the transport module) replaces the default
+    pooled HTTPAdapter when given.
+    """
+    s = requests.Session()
+    s.headers.update(DEFAULT_HEADERS)
+    if headers:
+        s.headers.update(headers)
+
+    if adapter is None:
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+
+    return s
+
+
+def configure(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+              headers=None, adapter=None):
+    """Replace the shared session.
+
+    Args:
+        pool_size (int): connections kept alive per host.
+
+        timeout (float): seconds before a request is abandoned.
+
+        headers (dict, optional): headers sent in addition to the defaults.
+
+        adapter (requests.adapters.BaseAdapter, optional): transport used
+            instead of the default pooled HTTPAdapter.
+    """
+    global session, request_timeout
+
+    new_session = create_session(pool_size, headers, adapter)
+    with _session_lock:
+        old_session = session
+        session = new_session
+        request_timeout = timeout
+
+    if old_session is not None:
+        old_session.close()
+
+    return new_session
+
+
+def get_session():
+    """Return the shared session, creating it with defaults if needed."""
+    global session
+
+    with _session_lock:
+        if session is None:
+            session = create_session()
+        return session
+
+
+def get(url, **kwargs):
+    """Perform a GET request through the shared session.
+
+    Accepts the same keyword arguments as requests.get. The configured timeout
+    is used unless one is given.
+
+    Requests wait for their host in the shared rate limiter (see the
+    ratelimit module), and are sent again up to OVERLOAD_RETRIES times when
+    the host answers 429 or 503. A streamed response (stream=True) holds its
+    host's slot until it is closed, so the body transfer counts toward the
+    host's concurrency. Always close streamed responses.
+    """
+    kwargs.setdefault('timeout', request_timeout)
+    host = ratelimit.get_limiter().get_host(url)
+
+    for attempt in range(OVERLOAD_RETRIES + 1):
+        if attempt:
+            metrics.record_retry(url)
+
+        with tracing.span('wait', 'http', url=url):
+            host.acquire()
+
+        start = time.perf_counter()
+        try:
+            with tracing.span('GET', 'http', url=url):
+                response = get_session().get(url, **kwargs)
+        except requests.RequestException:
+            host.release()
+            metrics.record_request(url, time.perf_counter() - start)
+            raise
+        metrics.record_request(
+            url, time.perf_counter() - start, response.status_code)
+
+        overloaded = response.status_code in ratelimit.OVERLOAD_STATUSES
+        retry_after = None
+        if overloaded:
+            retry_after = ratelimit.parse_retry_after(
+                response.headers.get('retry-after'))
+
+        if not overloaded or attempt == OVERLOAD_RETRIES:
+            if kwargs.get('stream'):
+                _release_on_close(
+                    response, host, response.status_code, retry_after)
+            else:
+                host.release(response.status_code, retry_after)
+            return response
+
+        host.release(response.status_code, retry_after)
+        response.close()
+
+
+def _release_on_close(response, host, status, retry_after):
+    # Release the host's slot once the response is closed
+    close = response.close
+    released = False
+
+    def close_and_release():
+        nonlocal released
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                host.release(status, retry_after)
+
+    response.close = close_and_release
+
+
+def get_listing(url, ttl=None, **kwargs):
+    """GET a listing page, through the listing cache if one is loaded.
+
+    Streamed listings (stream=True) skip the cache. They are parsed as they
+    arrive and often left unread past the scrape window, the cache would
+    read each one whole first.
+
+    Args:
+        url (str): the URL to GET.
+
+        ttl (float, optional): seconds a cached copy is used without asking
+            the server, overrides the cache's TTL.
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.span('listing', 'http', url=url):
+            cache = httpcache.get_cache()
+            if cache is None or kwargs.get('stream'):
+                return get(url, **kwargs)
+            return cache.get(get, url, ttl=ttl, **kwargs)
+    finally:
+        metrics.record_listing(url, time.perf_counter() - start)
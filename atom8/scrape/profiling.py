@@ -0,0 +1,155 @@
+"""Atom8 Scrape - Profiling mode
+
+Profiles a scrape with cProfile. Each integration's own threads are profiled
+under its name, and the download jobs it submits under 'download-<name>', so
+discovery and downloading show up separately. Allocations can be tracked with
+tracemalloc as well.
+
+When the run stops, the profiles are written to a directory as
+<name>.prof files (readable with pstats or snakeviz), with summary.txt listing
+the top functions of each and, if tracked, the top allocating lines.
+
+profiled() does nothing unless a profiler was started with start(), so the
+hooks can stay in place.
+"""
+
+import collections
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+
+PROFILE_DIRECTORY = 'profile'
+SUMMARY_FILENAME = 'summary.txt'
+
+# Functions and allocation sites listed per profile in the summary
+DEFAULT_TOP = 25
+
+# Frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 10
+
+# Running profiler, see start()
+profiler = None
+
+
+class Profiler():
+
+    def __init__(self, directory, memory=False, top=DEFAULT_TOP):
+        self.directory = directory
+        self.memory = memory
+        self.top = top
+
+        # name -> a cProfile.Profile per thread that ran under the name
+        self._profiles = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """Profile a block of the current thread under `name`.
+
+        Blocks nested in a profiled block count toward the outer name.
+        """
+        if getattr(self._local, 'active', False):
+            yield
+            return
+
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
+
+        profile = profiles.get(name)
+        if profile is None:
+            profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profile at a time, other threads
+            # run unprofiled
+            yield
+            return
+
+        # Kept once it has run, profiles that never ran can not be read
+        if name not in profiles:
+            profiles[name] = profile
+            with self._lock:
+                self._profiles[name].append(profile)
+
+        self._local.active = True
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._local.active = False
+
+    def stop(self):
+        """Write the profiles and summary, returns the summary path."""
+        os.makedirs(self.directory, exist_ok=True)
+
+        snapshot = None
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        summary = io.StringIO()
+        with self._lock:
+            profiles = sorted(self._profiles.items())
+
+        for name, thread_profiles in profiles:
+            stats = pstats.Stats(*thread_profiles, stream=summary)
+            stats.dump_stats(os.path.join(self.directory, name + '.prof'))
+
+            summary.write('=== %s (%d threads) ===\n' % (
+                name, len(thread_profiles)))
+            stats.sort_stats('cumulative').print_stats(self.top)
+            stats.sort_stats('tottime').print_stats(self.top)
+
+        if snapshot is not None:
+            summary.write('=== allocations ===\n')
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                summary.write('%s\n' % stat)
+
+        summary_path = os.path.join(self.directory, SUMMARY_FILENAME)
+        with open(summary_path, 'w') as f:
+            f.write(summary.getvalue())
+        return summary_path
+
+
+def start(directory, memory=False, top=DEFAULT_TOP):
+    """Start profiling, the profiles are written to `directory` by stop()."""
+    global profiler
+
+    profiler = Profiler(directory, memory, top)
+    profiler.start()
+    return profiler
+
+
+def stop():
+    """Stop profiling and write the profiles.
+
+    Returns:
+        str: path of the summary, None if no profiler was running.
+    """
+    global profiler
+
+    if profiler is None:
+        return None
+
+    summary_path = profiler.stop()
+    profiler = None
+    return summary_path
+
+
+def profiled(name):
+    """Profile a block under `name` if a profiler is running."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile(name)
@@ -0,0 +1,206 @@
+"""Atom8 Scrape - Per-host rate limiter
+
+Every request made through net.get waits for a slot of its host here. A host
+has a token bucket limiting its request rate, and a concurrency limit adapted
+AIMD style: it is halved when the host answers 429 Too Many Requests or 503
+Service Unavailable and grows back by about one slot per round of healthy
+responses. A Retry-After header pauses all requests to the host until then.
+
+Rates are set per host in the "rate_limits" of each integration's settings:
+    "reddit": {
+        "rate_limits": {
+            "reddit.com": {"rate": 1, "burst": 10},
+            "i.redd.it": {"rate": 10, "burst": 20, "max_concurrency": 8}
+        }
+    }
+
+A rule applies to its host and every subdomain, each with a bucket of its own.
+Hosts without a rule are not rate limited but still back off when overloaded.
+"""
+
+import email.utils
+import threading
+import time
+import urllib.parse
+
+# Concurrent requests per host when its rule does not set a limit
+DEFAULT_MAX_CONCURRENCY = 16
+
+# Seconds a host is paused after an overload response without Retry-After
+DEFAULT_BACKOFF = 5
+
+# Longest Retry-After pause honored, in seconds
+MAX_BACKOFF = 300
+
+# Status codes telling a client to slow down
+OVERLOAD_STATUSES = (429, 503)
+
+# Shared limiter, created on first use or through configure()
+limiter = None
+_limiter_lock = threading.Lock()
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait from a Retry-After header, None if invalid.
+
+    The header is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+class HostLimiter():
+
+    def __init__(self, rate=None, burst=1, max_concurrency=None):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+
+        # Adapted concurrency limit, starting at the maximum
+        self.limit = float(self.max_concurrency)
+
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._blocked_until = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a token and a free slot, then take them."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._blocked_until:
+                    timeout = self._blocked_until - now
+                elif self._active >= int(self.limit):
+                    # Woken by release()
+                    timeout = None
+                elif self.rate is not None and self._tokens < 1:
+                    timeout = (1 - self._tokens) / self.rate
+                else:
+                    break
+
+                self._condition.wait(timeout)
+
+            self._active += 1
+            if self.rate is not None:
+                self._tokens -= 1
+
+    def release(self, status=None, retry_after=None):
+        """Free a slot and adapt the limit to the response status.
+
+        Args:
+            status (int, optional): response status, None if the request
+                failed without one.
+
+            retry_after (float, optional): seconds the host asked to wait.
+        """
+        with self._condition:
+            self._active -= 1
+            now = time.monotonic()
+
+            if status in OVERLOAD_STATUSES:
+                # Requests answered during a pause were sent before it, the
+                # limit is only cut once per overload
+                if now >= self._blocked_until:
+                    self.limit = max(self.limit / 2, 1)
+
+                if retry_after is None:
+                    retry_after = DEFAULT_BACKOFF
+                self._blocked_until = max(
+                    self._blocked_until, now + min(retry_after, MAX_BACKOFF))
+            elif status is not None and status < 500:
+                self.limit = min(
+                    self.limit + 1 / self.limit, self.max_concurrency)
+
+            self._condition.notify_all()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(
+                self._tokens + (now - self._refilled) * self.rate,
+                self.burst)
+        self._refilled = now
+
+
+class RateLimiter():
+    """Holds a HostLimiter for every host requested."""
+
+    def __init__(self, rules=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # host -> rule, see the module docstring
+        self.rules = {host.lower(): rule for host, rule in
+                      (rules or {}).items()}
+        self.max_concurrency = max_concurrency
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def get_host(self, url):
+        """Return the HostLimiter of a url's host."""
+        host = (urllib.parse.urlsplit(url).hostname or '').lower()
+
+        with self._lock:
+            if host not in self._hosts:
+                rule = self._find_rule(host)
+                self._hosts[host] = HostLimiter(
+                    rule.get('rate'), rule.get('burst', 1),
+                    rule.get('max_concurrency', self.max_concurrency))
+            return self._hosts[host]
+
+    def _find_rule(self, host):
+        # The most specific rule matching the host or one of its parents
+        parts = host.split('.')
+        for i in range(len(parts)):
+            rule = self.rules.get('.'.join(parts[i:]))
+            if rule is not None:
+                return rule
+        return {}
+
+
+def rules_from_settings(settings):
+    """Merge the "rate_limits" of every integration in a settings dict."""
+    rules = {}
+    for integration_settings in settings.values():
+        if isinstance(integration_settings, dict):
+            rules.update(integration_settings.get('rate_limits', {}))
+    return rules
+
+
+def configure(rules=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Replace the shared limiter.
+
+    Args:
+        rules (dict, optional): host -> {"rate", "burst", "max_concurrency"}.
+
+        max_concurrency (int): concurrency limit of hosts whose rule does
+            not set one.
+    """
+    global limiter
+
+    with _limiter_lock:
+        limiter = RateLimiter(rules, max_concurrency)
+        return limiter
+
+
+def get_limiter():
+    """Return the shared limiter, creating it with defaults if needed."""
+    global limiter
+
+    with _limiter_lock:
+        if limiter is None:
+            limiter = RateLimiter()
+        return limiter
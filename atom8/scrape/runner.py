@@ -0,0 +1,205 @@
+"""Atom8 Scrape - Integration runner
+
+Runs the selected integrations at the same time, each in its own thread, so a
+run takes about as long as its slowest source. An integration that fails is
+reported in the summary and does not stop the others.
+
+The stores kept between scrapes (scrape state, media index, seen URL index,
+listing cache and catalog) are loaded with load_stores(), from one data
+directory, and saved once a run completes.
+"""
+
+import collections
+import concurrent.futures
+import os
+import time
+
+from . import (
+    catalog, dedup, httpcache, integrations, manifest, metrics, profiling,
+    seen, state, tracing)
+
+# Integration name -> (module, settings key holding its scrape targets,
+#                      settings keys passed on to scrape() when present)
+INTEGRATIONS = collections.OrderedDict([
+    ('instagram', (integrations.instagram, 'profiles', ())),
+    ('reddit', (integrations.reddit, 'subreddits',
+                ('batch_size', 'karma_grace_hours'))),
+    ('tigsource', (integrations.tigsource, 'topics', ('search',))),
+    ('tumblr', (integrations.tumblr, 'blogs', ('page_size',))),
+    ('twitter', (integrations.twitter, 'users', ())),
+])
+
+# Outcome of one integration. `error` is None when the scrape completed.
+IntegrationSummary = collections.namedtuple(
+    'IntegrationSummary',
+    ['name', 'ok', 'downloaded', 'failed', 'elapsed', 'error'])
+
+
+def run_integrations(names, settings, export_directory, days, verbose=True):
+    """Scrape several integrations concurrently.
+
+    Args:
+        names (list): integration names, keys of INTEGRATIONS.
+
+        settings (dict): scrape settings, holding the targets of each
+            integration.
+
+        export_directory (str): directory images are downloaded to.
+
+        days (int): number of days to scrape.
+
+        verbose (bool): print progress while scraping.
+
+    Returns:
+        list: an IntegrationSummary per integration, in the order given.
+    """
+    if not names:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(names),
+            thread_name_prefix='atom8-integration') as executor:
+        futures = [
+            executor.submit(
+                run_integration, name, settings, export_directory, days,
+                verbose)
+            for name in names
+        ]
+
+    summaries = [future.result() for future in futures]
+
+    # Keep the watermarks of the integrations that completed
+    store = state.get_state()
+    if store is not None:
+        for summary in summaries:
+            if summary.ok:
+                store.commit(summary.name)
+            else:
+                store.discard(summary.name)
+        store.save()
+
+    media_index = dedup.get_index()
+    if media_index is not None:
+        media_index.save()
+
+    seen_index = seen.get_index()
+    if seen_index is not None:
+        seen_index.save()
+
+    manifest.flush()
+
+    # Record what this scrape downloaded
+    media_catalog = catalog.get_catalog()
+    if media_catalog is not None:
+        media_catalog.add_export(export_directory)
+
+    return summaries
+
+
+def run_integration(name, settings, export_directory, days, verbose=True):
+    """Scrape a single integration, capturing any error it raises.
+
+    Returns:
+        IntegrationSummary
+    """
+    module, targets_key, option_keys = INTEGRATIONS[name]
+    start = time.time()
+
+    # This thread's track in the trace
+    tracing.name_thread(name)
+
+    try:
+        options = {key: settings[name][key]
+                   for key in option_keys if key in settings[name]}
+        with metrics.integration(name), profiling.profiled(name):
+            results = module.scrape(
+                settings[name][targets_key], export_directory, days=days,
+                verbose=verbose, **options)
+    except Exception as e:
+        print('[ERROR] %s scrape failed: %r' % (name, e))
+        return IntegrationSummary(
+            name, False, 0, 0, time.time() - start, repr(e))
+
+    results = results or []
+    downloaded = sum(1 for result in results if result.ok)
+
+    return IntegrationSummary(
+        name, True, downloaded, len(results) - downloaded,
+        time.time() - start, None)
+
+
+def data_path(data_directory, path):
+    """Resolve a path from the settings against the data directory.
+
+    Absolute paths, and paths starting with ~, are kept as they are.
+    """
+    return os.path.join(data_directory, os.path.expanduser(path))
+
+
+def load_stores(settings, data_directory, previous_scrapes=True,
+                state_path=None):
+    """Load the stores kept between scrapes.
+
+    The paths of the stores are read from the "all" settings and resolved
+    against `data_directory` (see data_path).
+
+    Args:
+        settings (dict): the scrape settings.
+
+        data_directory (str): directory holding the stores, created if
+            needed.
+
+        previous_scrapes (bool): load what previous scrapes have seen: the
+            scrape state, listing cache, seen URL index and catalog. Only
+            the media index is loaded otherwise.
+
+        state_path (str, optional): scrape state to use instead of the one
+            in the settings, used as given.
+    """
+    all_settings = settings.get('all', {})
+    os.makedirs(data_directory, exist_ok=True)
+
+    def path(key, default):
+        return data_path(data_directory, all_settings.get(key, default))
+
+    # Downloads already in the media index are stored as duplicates
+    dedup.load_index(
+        path('media_index_path', dedup.DEFAULT_INDEX_PATH),
+        all_settings.get('dedup_mode', dedup.DEFAULT_DEDUP_MODE))
+
+    if not previous_scrapes:
+        return
+
+    # Scrapes stop at the newest post seen by previous scrapes
+    if state_path is None:
+        state_path = path('state_path', state.DEFAULT_STATE_PATH)
+    state.load_state(state_path)
+
+    # Unchanged listing pages are answered from the cache
+    httpcache.load_cache(
+        path('http_cache_directory', httpcache.DEFAULT_CACHE_DIRECTORY),
+        all_settings.get('http_cache_ttl', httpcache.DEFAULT_TTL),
+        all_settings.get('http_cache_max_size', httpcache.DEFAULT_MAX_SIZE))
+
+    # Media urls downloaded by previous scrapes are skipped
+    seen.load_index(path('seen_index_path', seen.DEFAULT_SEEN_PATH))
+
+    # Everything downloaded is recorded in the catalog
+    catalog.load_catalog(path('catalog_path', catalog.DEFAULT_CATALOG_PATH))
+
+
+def print_summary(summaries):
+    """Print a table of integration summaries."""
+    print('\nSCRAPE SUMMARY')
+    for summary in summaries:
+        status = 'ok' if summary.ok else 'FAILED'
+        print('%-10s %-7s %5d downloaded %5d failed %8.1fs' % (
+            summary.name, status, summary.downloaded, summary.failed,
+            summary.elapsed))
+        if summary.error is not None:
+            print('    ' + summary.error)
+
+    total_downloaded = sum(s.downloaded for s in summaries)
+    total_failed = sum(s.failed for s in summaries)
+    print('%-10s %-7s %5d downloaded %5d failed' % (
+        'total', '', total_downloaded, total_failed))
@@ -0,0 +1,143 @@
+"""Atom8 Scrape - Seen URL index
+
+A persistent record of every media URL downloaded successfully. URLs already
+in the index are dropped before they are queued for download, so overlapping
+scrape windows do not fetch the same media again.
+
+URLs are normalized before they are recorded (see normalize_url) and stored
+as 64-bit hashes, so the index takes 8 bytes per URL on disk. The hashes are
+held in a sorted array, also 8 bytes each, and searched with bisect. Only
+the URLs added during a run are kept in a set until the index is saved.
+"""
+
+import array
+import bisect
+import hashlib
+import heapq
+import os
+import threading
+import urllib.parse
+
+DEFAULT_SEEN_PATH = 'seen_urls.bin'
+
+# Hosts serving the same file under different signed/resized query strings,
+# e.g. https://i.redditmedia.com/<id>.gif?fm=jpg&amp;s=<signature>
+UNSIGNED_HOSTS = (
+    'i.redditmedia.com',
+    'preview.redd.it',
+    'external-preview.redd.it',
+    'i.redd.it',
+    'media.tumblr.com',
+    'pbs.twimg.com',
+    'cdninstagram.com',
+)
+
+# Seen URL index, loaded through load_index()
+index = None
+
+
+def normalize_url(url):
+    """Reduce a URL to a canonical form.
+
+    The scheme and host are lowercased, http is treated as https, fragments
+    are dropped and leftover HTML escaping ('&amp;') is undone. Query strings
+    are dropped for UNSIGNED_HOSTS and sorted for every other host.
+    """
+    url = url.strip().replace('&amp;', '&')
+    parts = urllib.parse.urlsplit(url)
+
+    scheme = parts.scheme.lower()
+    if scheme == 'http':
+        scheme = 'https'
+
+    host = parts.netloc.lower()
+    if host.endswith(':443') or host.endswith(':80'):
+        host = host.rsplit(':', 1)[0]
+
+    if any(host == h or host.endswith('.' + h) for h in UNSIGNED_HOSTS):
+        query = ''
+    else:
+        params = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        query = urllib.parse.urlencode(sorted(params))
+
+    return urllib.parse.urlunsplit((scheme, host, parts.path, query, ''))
+
+
+def hash_url(url):
+    """Return the 64-bit hash of a normalized URL."""
+    digest = hashlib.blake2b(
+        normalize_url(url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class SeenIndex():
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        # Saved hashes, sorted, and the hashes added since
+        self._hashes = array.array('Q')
+        self._new = set()
+
+        try:
+            with open(path, 'rb') as f:
+                self._hashes.frombytes(f.read())
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, url):
+        return self._contains(hash_url(url))
+
+    def __len__(self):
+        return len(self._hashes) + len(self._new)
+
+    def add(self, url):
+        h = hash_url(url)
+        if not self._contains(h):
+            with self._lock:
+                self._new.add(h)
+
+    def save(self):
+        with self._lock:
+            hashes = array.array('Q', heapq.merge(
+                self._hashes, sorted(self._new)))
+            self._hashes = hashes
+            self._new = set()
+
+        # Write beside the index and swap it in, so a crash never truncates it
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(hashes.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def _contains(self, h):
+        if h in self._new:
+            return True
+
+        hashes = self._hashes
+        i = bisect.bisect_left(hashes, h)
+        return i < len(hashes) and hashes[i] == h
+
+
+def get_index():
+    return index
+
+
+def load_index(path=DEFAULT_SEEN_PATH):
+    """Load the seen URL index from a path and make it the shared index."""
+    global index
+
+    index = SeenIndex(path)
+    return index
+
+
+def is_seen(url):
+    """Check if a URL was downloaded before, False if no index is loaded."""
+    return index is not None and url in index
+
+
+def mark_seen(url):
+    """Record a URL as downloaded, does nothing if no index is loaded."""
+    if index is not None:
+        index.add(url)
@@ -0,0 +1,144 @@
+"""Atom8 Scrape - Scrape state
+
+Remembers the newest post seen for every scrape target (subreddit, tumblr
+blog, twitter user, instagram profile, TIGSource topic). Integrations stop
+paging as soon as they reach that post, so frequent runs only read the first
+listing page of each source.
+
+Watermarks found during a run are staged per integration and only committed
+once that integration completes, so a failed scrape is retried in full on the
+next run.
+
+Posts inside the scrape window that were not taken, because a filter left
+them out for now or their download failed, hold the watermark of their target
+below them, see hold_watermark(). The next run pages back to them again.
+Reddit posts under min_karma only do so for a grace period after they are
+posted (see reddit.KARMA_GRACE_HOURS).
+"""
+
+import threading
+
+from . import etc
+
+DEFAULT_STATE_PATH = 'state.json'
+
+# Scrape state, loaded through load_state()
+store = None
+
+
+class StateStore():
+
+    def __init__(self, path):
+        self.path = path
+        self.watermarks = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        try:
+            self.watermarks = etc.retrieve_JSON(path)
+        except FileNotFoundError:
+            pass
+
+    def get_watermark(self, source, target):
+        """Return the newest post committed for a target.
+
+        Returns:
+            dict: {'id': post id, 'timestamp': epoch seconds}, or None if the
+                target has not been scraped before.
+        """
+        with self._lock:
+            return self.watermarks.get(source, {}).get(str(target))
+
+    def update_watermark(self, source, target, post_id, timestamp):
+        """Stage a post as seen."""
+        with self._lock:
+            staged = self._staged(source, target)
+            staged['posts'].append((timestamp, post_id))
+
+    def hold_watermark(self, source, target, timestamp=None):
+        """Keep the watermark of a target older than a post not taken.
+
+        With no `timestamp` the committed watermark of the target is kept.
+        """
+        if timestamp is None:
+            timestamp = float('-inf')
+
+        with self._lock:
+            staged = self._staged(source, target)
+            if staged['hold'] is None or timestamp < staged['hold']:
+                staged['hold'] = timestamp
+
+    def commit(self, source):
+        """Make the watermarks staged by an integration permanent.
+
+        Each target's watermark becomes the newest staged post older than
+        every post holding it.
+        """
+        with self._lock:
+            pending = self._pending.pop(source, {})
+            committed = self.watermarks.setdefault(source, {})
+            for target, staged in pending.items():
+                posts = staged['posts']
+                if staged['hold'] is not None:
+                    posts = [post for post in posts
+                             if post[0] < staged['hold']]
+                if not posts:
+                    continue
+
+                timestamp, post_id = max(posts, key=lambda post: post[0])
+                current = committed.get(target)
+                if current is None or timestamp > current['timestamp']:
+                    committed[target] = {
+                        'id': post_id, 'timestamp': timestamp}
+
+    def discard(self, source):
+        """Forget the watermarks staged by an integration."""
+        with self._lock:
+            self._pending.pop(source, None)
+
+    def save(self):
+        with self._lock:
+            etc.export_JSON(self.path, self.watermarks)
+
+    def _staged(self, source, target):
+        # The posts staged for a target and the oldest post holding it
+        return self._pending.setdefault(source, {}).setdefault(
+            str(target), {'posts': [], 'hold': None})
+
+
+def get_state():
+    return store
+
+
+def load_state(path=DEFAULT_STATE_PATH):
+    """Load the scrape state from a path and make it the shared store."""
+    global store
+
+    store = StateStore(path)
+    return store
+
+
+def get_watermark(source, target):
+    """Return the watermark of a target, None if no state is loaded."""
+    if store is None:
+        return None
+    return store.get_watermark(source, target)
+
+
+def update_watermark(source, target, post_id, timestamp):
+    """Stage a post as seen, does nothing if no state is loaded."""
+    if store is not None:
+        store.update_watermark(source, target, post_id, timestamp)
+
+
+def hold_watermark(source, target, timestamp=None):
+    """Hold a target's watermark below a post, see StateStore."""
+    if store is not None:
+        store.hold_watermark(source, target, timestamp)
+
+
+def reached_watermark(watermark, post_id, timestamp):
+    """Check whether a post is at or older than a watermark."""
+    if watermark is None:
+        return False
+    return post_id == watermark['id'] or timestamp <= watermark['timestamp']
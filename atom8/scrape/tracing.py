@@ -0,0 +1,146 @@
+"""Atom8 Scrape - Timeline tracing
+
+Records a timeline of a scrape in the Chrome trace event format, viewable in
+chrome://tracing or https://ui.perfetto.dev. Every HTTP request, parse,
+download, file write and manifest write is a span on the track of the thread
+that ran it, so integration threads and download workers each get a track.
+
+span() returns a shared no-op context unless tracing was started with
+start(), so the hooks cost next to nothing while tracing is off. While it is
+on, a span is two clock reads and a list append.
+"""
+
+import json
+import os
+import threading
+import time
+
+TRACE_FILENAME = 'trace.json'
+
+# Events kept, later spans are dropped so a long run can not exhaust memory
+MAX_EVENTS = 1000000
+
+# Running tracer, see start()
+tracer = None
+
+
+class Tracer():
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.dropped = 0
+        self._start = time.perf_counter()
+        self._events = []
+        self._lock = threading.Lock()
+
+        # Thread idents whose track has been named
+        self._named = set()
+
+    def now(self):
+        """Microseconds since the trace started."""
+        return (time.perf_counter() - self._start) * 1e6
+
+    def add(self, name, category, start, end, args):
+        tid = threading.get_ident()
+        if tid not in self._named:
+            self.name_thread(threading.current_thread().name)
+
+        if len(self._events) >= MAX_EVENTS:
+            self.dropped += 1
+            return
+
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start,
+                 'dur': end - start, 'pid': self.pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    def name_thread(self, name):
+        """Name the track of the current thread."""
+        tid = threading.get_ident()
+        with self._lock:
+            self._named.add(tid)
+            self._events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                'tid': tid, 'args': {'name': name}})
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            json.dump({
+                'traceEvents': self._events,
+                'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped},
+            }, f)
+
+
+class Span():
+    """A traced block, see span()."""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(
+            self.name, self.category, self.start, self.tracer.now(),
+            self.args)
+
+
+class _NoSpan():
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start(path):
+    """Start tracing, the trace is written to `path` by stop()."""
+    global tracer
+
+    tracer = Tracer(path)
+    return tracer
+
+
+def stop():
+    """Stop tracing and write the trace.
+
+    Returns:
+        str: path of the trace, None if no tracer was running.
+    """
+    global tracer
+
+    if tracer is None:
+        return None
+
+    stopped, tracer = tracer, None
+    stopped.write()
+    return stopped.path
+
+
+def span(name, category='scrape', **args):
+    """Trace a block as a span named `name`, with `args` shown beside it."""
+    if tracer is None:
+        return _NO_SPAN
+    return Span(tracer, name, category, args)
+
+
+def name_thread(name):
+    """Name the current thread's track, if tracing."""
+    if tracer is not None:
+        tracer.name_thread(name)
@@ -0,0 +1,222 @@
+"""Atom8 Scrape - Record/replay transport
+
+Transport adapters for the shared session (see net.configure). The recording
+adapter saves every exchange made through the session into an archive, the
+replay adapter answers requests from such an archive without touching the
+network. Replayed responses are delayed by their recorded latency, scaled by
+`latency_scale`, so a replayed scrape is timed like the original.
+
+Response bodies are written to the archive as the caller reads them, never
+held whole in memory. A body the caller stops reading early, e.g. a rejected
+download, is archived as far as it was read.
+
+The archive also records when recording started. The scrape clock (see
+clock.py) is frozen at that time while recording and while replaying, so the
+replay scrapes the same window and makes the same requests.
+
+An archive is a directory holding:
+    archive.json        {"recorded_at": epoch seconds}
+    exchanges.jsonl     one JSON line per exchange
+    bodies/<sha1>       response bodies, named by their SHA-1
+"""
+
+import collections
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+ARCHIVE_FILENAME = 'archive.json'
+EXCHANGES_FILENAME = 'exchanges.jsonl'
+BODIES_DIRECTORY = 'bodies'
+
+
+class RecordingAdapter(HTTPAdapter):
+    """An HTTPAdapter that also writes every exchange to an archive."""
+
+    def __init__(self, archive_directory, **kwargs):
+        super().__init__(**kwargs)
+        self.archive_directory = archive_directory
+        self.recorded_at = time.time()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(archive_directory, BODIES_DIRECTORY),
+                    exist_ok=True)
+
+        with open(os.path.join(archive_directory, ARCHIVE_FILENAME),
+                  'w') as f:
+            json.dump({'recorded_at': self.recorded_at}, f)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+
+        exchange = {
+            'method': request.method,
+            'url': request.url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict(response.headers),
+            'elapsed': time.perf_counter() - start,
+        }
+
+        # The exchange is archived once its body is read or closed
+        response.raw = RecordedBody(self, response.raw, exchange)
+        return response
+
+    def archive(self, exchange, part_path, body_name):
+        """Add an exchange whose body was written to `part_path`."""
+        exchange = dict(exchange, body=body_name)
+
+        with self._lock:
+            body_path = os.path.join(
+                self.archive_directory, BODIES_DIRECTORY, body_name)
+            if os.path.exists(body_path):
+                os.remove(part_path)
+            else:
+                os.replace(part_path, body_path)
+
+            exchanges_path = os.path.join(
+                self.archive_directory, EXCHANGES_FILENAME)
+            with open(exchanges_path, 'a') as f:
+                f.write(json.dumps(exchange) + '\n')
+
+
+class RecordedBody():
+    """The raw stream of a recorded response, copied to the archive as it is
+    read.
+
+    Reads return decoded content, like the bodies served on replay.
+    """
+
+    def __init__(self, adapter, raw, exchange):
+        self.decode_content = True
+        self._adapter = adapter
+        self._raw = raw
+        self._exchange = exchange
+        self._sha1 = hashlib.sha1()
+        self._done = False
+        self._file = tempfile.NamedTemporaryFile(
+            dir=os.path.join(adapter.archive_directory, BODIES_DIRECTORY),
+            suffix='.part', delete=False)
+
+    @property
+    def closed(self):
+        return self._done
+
+    @property
+    def _original_response(self):
+        # Read by requests to extract cookies
+        return getattr(self._raw, '_original_response', None)
+
+    def read(self, amt=None, **kwargs):
+        if self._done:
+            return b''
+
+        data = self._raw.read(amt, decode_content=True)
+        # Compressed content can decode to nothing before the end
+        while amt and not data and not self._raw.closed:
+            data = self._raw.read(amt, decode_content=True)
+
+        if data:
+            self._sha1.update(data)
+            self._file.write(data)
+        if not data or amt is None:
+            self._finish()
+        return data
+
+    def close(self):
+        self._finish()
+        self._raw.close()
+
+    def release_conn(self):
+        self._raw.release_conn()
+
+    def _finish(self):
+        if self._done:
+            return
+
+        self._done = True
+        self._file.close()
+        self._adapter.archive(
+            self._exchange, self._file.name, self._sha1.hexdigest())
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from an archive made by RecordingAdapter.
+
+    Repeated requests for the same URL are answered in recorded order, the
+    last recording is reused once they run out.
+
+    `recorded_at` is when the archive was recorded, None for archives made
+    before it was kept.
+    """
+
+    def __init__(self, archive_directory, latency_scale=1.0):
+        super().__init__()
+        self.archive_directory = archive_directory
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+
+        self.recorded_at = None
+        try:
+            with open(os.path.join(
+                    archive_directory, ARCHIVE_FILENAME)) as f:
+                self.recorded_at = json.load(f)['recorded_at']
+        except FileNotFoundError:
+            pass
+
+        # (method, url) -> exchanges in recorded order
+        self._exchanges = collections.defaultdict(list)
+        self._served = collections.Counter()
+
+        exchanges_path = os.path.join(archive_directory, EXCHANGES_FILENAME)
+        with open(exchanges_path) as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    key = (exchange['method'], exchange['url'])
+                    self._exchanges[key].append(exchange)
+
+    def send(self, request, **kwargs):
+        key = (request.method, request.url)
+
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if not recorded:
+                raise requests.ConnectionError(
+                    'Not in replay archive: %s %s' % key, request=request)
+
+            n = self._served[key]
+            self._served[key] += 1
+            exchange = recorded[min(n, len(recorded) - 1)]
+
+        if self.latency_scale > 0:
+            time.sleep(exchange['elapsed'] * self.latency_scale)
+
+        body_path = os.path.join(
+            self.archive_directory, BODIES_DIRECTORY, exchange['body'])
+        with open(body_path, 'rb') as f:
+            body = f.read()
+
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response._content = body
+        response.raw = io.BytesIO(body)
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,264 @@
+"""Atom8 Scrape - End-to-end benchmarks
+
+Runs reddit.scrape, tumblr.scrape and tigsource.scrape against the local stub
+server (see stub.py) and reports throughput, request latency percentiles and
+peak RSS. Each scrape runs in a fresh process so its peak RSS is its own.
+
+Results are saved as JSON, by default to bench/results/<commit>.json, and two
+result files can be compared with --compare.
+
+Usage:
+    python -m bench.run -v --posts 2000 --image-size 131072
+    python -m bench.run --compare bench/results/a1b2c3d.json \\
+        bench/results/e4f5a6b.json
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from atom8.scrape import download, net, runner
+
+from .stub import MEDIA_HOSTS, StubAdapter, StubConfig, StubServer
+
+BENCH_INTEGRATIONS = ('reddit', 'tumblr', 'tigsource')
+
+SETTINGS = {
+    'reddit': {
+        'subreddits': [
+            {'name': 'BenchPixelArt', 'min_karma': 0},
+            {'name': 'BenchIndieGaming', 'min_karma': 0},
+        ],
+    },
+    'tumblr': {
+        'blogs': ['benchblog'],
+    },
+    'tigsource': {
+        'topics': ['167'],
+        'search': 'linear',
+    },
+}
+
+METADATA_EXTENSIONS = ('.meta', '.jsonl')
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+# Metrics shown by --compare, and whether a larger value is better
+COMPARED_METRICS = (
+    ('elapsed', False),
+    ('items_per_second', True),
+    ('mb_per_second', True),
+    ('listing_p50', False),
+    ('listing_p90', False),
+    ('media_p50', False),
+    ('media_p90', False),
+    ('peak_rss_mb', False),
+)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_scenario(name, base_url, options, results):
+    """Scrape one integration against the stub. Runs in a child process."""
+    pool_size = max(options['workers'], net.DEFAULT_POOL_SIZE)
+    adapter = StubAdapter(
+        base_url, pool_connections=pool_size, pool_maxsize=pool_size)
+    net.configure(pool_size=pool_size, adapter=adapter)
+    download.configure(options['workers'], options['queue_depth'])
+
+    export_directory = tempfile.mkdtemp(prefix='atom8-bench-')
+    try:
+        start = time.perf_counter()
+        summary = runner.run_integration(
+            name, SETTINGS, export_directory, options['days'],
+            verbose=False)
+        elapsed = time.perf_counter() - start
+
+        # Media only, not the metadata written beside it
+        total_bytes = sum(
+            os.path.getsize(os.path.join(export_directory, filename))
+            for filename in os.listdir(export_directory)
+            if not filename.endswith(METADATA_EXTENSIONS))
+    finally:
+        shutil.rmtree(export_directory, ignore_errors=True)
+
+    listing = [t for host, t in adapter.timings if host not in MEDIA_HOSTS]
+    media = [t for host, t in adapter.timings if host in MEDIA_HOSTS]
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    results.put({
+        'ok': summary.ok,
+        'error': summary.error,
+        'elapsed': elapsed,
+        'items': summary.downloaded,
+        'failed': summary.failed,
+        'bytes': total_bytes,
+        'items_per_second': summary.downloaded / elapsed,
+        'mb_per_second': total_bytes / elapsed / 2**20,
+        'listing_requests': len(listing),
+        'listing_p50': percentile(listing, 50),
+        'listing_p90': percentile(listing, 90),
+        'listing_p99': percentile(listing, 99),
+        'media_requests': len(media),
+        'media_p50': percentile(media, 50),
+        'media_p90': percentile(media, 90),
+        'media_p99': percentile(media, 99),
+        'peak_rss_mb': peak_rss / 2**20,
+    })
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline_path, candidate_path):
+    """Print the change of every compared metric between two result files."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    click.echo('%s (%s) -> %s (%s)' % (
+        baseline_path, baseline['commit'], candidate_path,
+        candidate['commit']))
+
+    for name in BENCH_INTEGRATIONS:
+        if name not in baseline['results'] or \
+                name not in candidate['results']:
+            continue
+
+        click.secho('\n' + name, fg='yellow')
+        for metric, higher_is_better in COMPARED_METRICS:
+            before = baseline['results'][name].get(metric)
+            after = candidate['results'][name].get(metric)
+            if not before or after is None:
+                continue
+
+            change = (after - before) / before * 100
+            improved = (change > 0) == higher_is_better
+            click.echo('  %-18s %12.4f %12.4f ' % (metric, before, after),
+                       nl=False)
+            click.secho('%+8.1f%%' % change,
+                        fg='green' if improved else 'red')
+
+
+@click.command()
+@click.option('-v', '--verbose', default=False, is_flag=True)
+@click.option('--posts', default=1000,
+              help='posts per listing (1000)')
+@click.option('--window', default=300,
+              help='posts inside the scraped time window (300)')
+@click.option('--images-per-post', default=1,
+              help='images in each tumblr photoset and TIGSource post (1)')
+@click.option('--image-size', default=64 * 1024,
+              help='bytes per image (65536)')
+@click.option('--listing-latency', default=0.05,
+              help='seconds before a listing is answered (0.05)')
+@click.option('--image-latency', default=0.05,
+              help='seconds before an image is answered (0.05)')
+@click.option('-w', '--workers', default=download.DEFAULT_WORKERS,
+              help='number of concurrent downloads (%d)'
+              % download.DEFAULT_WORKERS)
+@click.option('-q', '--queue-depth', default=download.DEFAULT_QUEUE_DEPTH,
+              help='images found ahead of the downloads (%d)'
+              % download.DEFAULT_QUEUE_DEPTH)
+@click.option('-o', '--output', default=None,
+              help='result file (bench/results/<commit>.json)')
+@click.option('--compare', 'compare_paths', nargs=2, default=None,
+              type=click.Path(exists=True),
+              help='compare two result files instead of running')
+@click.argument('integration', nargs=-1)
+def main(verbose, posts, window, images_per_post, image_size,
+         listing_latency, image_latency, workers, queue_depth, output,
+         compare_paths, integration):
+    """Benchmark scrapes against a local stub of each source."""
+
+    if compare_paths:
+        compare(*compare_paths)
+        return
+
+    names = integration or BENCH_INTEGRATIONS
+    for name in names:
+        if name not in BENCH_INTEGRATIONS:
+            raise click.BadParameter(
+                'no benchmark for %s' % name, param_hint='INTEGRATION')
+
+    config = StubConfig(
+        posts=posts, images_per_post=images_per_post, image_size=image_size,
+        listing_latency=listing_latency, image_latency=image_latency)
+
+    # The scrape window in days covering `window` posts, with half a post of
+    # margin so the window edge does not fall on a post
+    days = (window - 0.5) * config.post_interval / 86400.0
+
+    options = {
+        'posts': posts,
+        'window': window,
+        'days': days,
+        'images_per_post': images_per_post,
+        'image_size': image_size,
+        'listing_latency': listing_latency,
+        'image_latency': image_latency,
+        'workers': workers,
+        'queue_depth': queue_depth,
+    }
+
+    report = {
+        'commit': current_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': options,
+        'results': {},
+    }
+
+    context = multiprocessing.get_context('spawn')
+    with StubServer(config) as stub:
+        for name in names:
+            results = context.Queue()
+            process = context.Process(
+                target=run_scenario,
+                args=(name, stub.base_url, options, results))
+            process.start()
+            result = results.get()
+            process.join()
+
+            report['results'][name] = result
+            if verbose:
+                click.secho(name, fg='yellow')
+                for key, value in result.items():
+                    click.echo('  %-18s %s' % (key, value))
+
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, report['commit'] + '.json')
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    click.echo('Results saved to %s' % output)
+
+
+if __name__ == '__main__':
+    main()
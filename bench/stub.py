@@ -0,0 +1,241 @@
+"""Atom8 Scrape - Benchmark stub server
+
+A local HTTP server standing in for reddit, tumblr, TIGSource and their image
+hosts. Requests are addressed as http://<stub>/<original host>/<path>, see
+StubAdapter, which rewrites the URLs the integrations build.
+
+Listings are synthetic but shaped like the real ones (see
+doc/example_reddit_JSON.json, doc/example_tumblr_read.xml and
+doc/example_tigsource_topic.html). Posts are spread `post_interval` seconds
+apart going back from the time the server started, and every image is
+`image_size` bytes behind a PNG header.
+"""
+
+import html
+import json
+import os
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+# Hosts serving images rather than listings
+MEDIA_HOSTS = ('i.redd.it', '66.media.tumblr.com', 'i.imgur.com')
+
+TIG_POSTS_PER_PAGE = 20
+
+
+class StubConfig():
+
+    def __init__(self, posts=500, post_interval=600, images_per_post=1,
+                 image_size=64 * 1024, listing_latency=0.05,
+                 image_latency=0.05):
+        self.posts = posts
+        self.post_interval = post_interval
+        self.images_per_post = images_per_post
+        self.image_size = image_size
+        self.listing_latency = listing_latency
+        self.image_latency = image_latency
+        self.started = time.time()
+
+    def post_time(self, n):
+        """Time of the nth newest post."""
+        return self.started - n * self.post_interval
+
+
+class StubServer():
+    """Runs the stub in a background thread.
+
+    Usage:
+        with StubServer(StubConfig()) as stub:
+            adapter = StubAdapter(stub.base_url)
+    """
+
+    def __init__(self, config, host='127.0.0.1', port=0):
+        handler = type('Handler', (StubHandler,), {'config': config})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StubAdapter(HTTPAdapter):
+    """Sends every request to the stub, keeping the host in the path.
+
+    Records the latency of each request in `timings` as (host, seconds).
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.timings = []
+
+    def send(self, request, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        request.url = '%s/%s%s' % (
+            self.base_url, parts.netloc,
+            parts.path + ('?' + parts.query if parts.query else ''))
+
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.timings.append((parts.netloc, time.perf_counter() - start))
+        return response
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        _, host, path = self.path.split('/', 2)
+        path, _, query = ('/' + path).partition('?')
+        query = dict(urllib.parse.parse_qsl(query))
+
+        if host in MEDIA_HOSTS:
+            time.sleep(self.config.image_latency)
+            return self.send_image()
+
+        time.sleep(self.config.listing_latency)
+        if host.endswith('reddit.com'):
+            return self.send_reddit(path, query)
+        if host.endswith('.tumblr.com'):
+            return self.send_tumblr(host.split('.')[0], query)
+        if host == 'forums.tigsource.com':
+            return self.send_tigsource(query)
+
+        self.send_error(404)
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self):
+        size = max(self.config.image_size - len(PNG_HEADER), 0)
+        self.send_body(PNG_HEADER + os.urandom(size), 'image/png')
+
+    def send_reddit(self, path, query):
+        # /r/<subreddit>[+<subreddit>...]/new.json
+        subreddits = path.split('/')[2].split('+')
+        limit = int(query.get('limit', 25))
+        after = query.get('after')
+        start = int(after.split('_')[1]) if after else 0
+
+        children = []
+        for n in range(start, min(start + limit, self.config.posts)):
+            post_id = 'b%05d' % n
+            subreddit = subreddits[n % len(subreddits)]
+            image_url = 'https://i.redd.it/%s.png' % post_id
+            created = self.config.post_time(n)
+            children.append({'kind': 't3', 'data': {
+                'id': post_id,
+                'name': 't3_%d' % n,
+                'subreddit': subreddit,
+                'author': 'bench_user',
+                'title': 'Benchmark post %d' % n,
+                'domain': 'i.redd.it',
+                'url': image_url,
+                'permalink': '/r/%s/comments/%s/benchmark_post_%d/' % (
+                    subreddit, post_id, n),
+                'ups': 1000 - n % 1000,
+                'score': 1000 - n % 1000,
+                'created': created,
+                'created_utc': created,
+                'preview': {'images': [{
+                    'source': {'url': image_url, 'width': 320,
+                               'height': 1800},
+                    'resolutions': [
+                        {'url': image_url + '?width=%d' % w, 'width': w,
+                         'height': w * 5}
+                        for w in (108, 216, 320)
+                    ],
+                }]},
+            }})
+
+        after = None
+        if start + limit < self.config.posts:
+            after = 't3_%d' % (start + limit)
+
+        body = json.dumps({'kind': 'Listing', 'data': {
+            'children': children, 'after': after}})
+        self.send_body(body.encode('utf-8'), 'application/json')
+
+    def send_tumblr(self, blog, query):
+        num = int(query.get('num', 20))
+        start = int(query.get('start', 0))
+
+        posts = []
+        for n in range(start, min(start + num, self.config.posts)):
+            posted = datetime.fromtimestamp(self.config.post_time(n))
+            photos = ''.join(
+                '<photo offset="o%d"><photo-url max-width="1280">'
+                'https://66.media.tumblr.com/bench/tumblr_%s_%d_%d_1280.png'
+                '</photo-url></photo>' % (i + 1, blog, n, i)
+                for i in range(self.config.images_per_post))
+            posts.append(
+                '<post id="%d" type="photo" date="%s" '
+                'unix-timestamp="%d"><photo-caption>Benchmark post %d'
+                '</photo-caption><photo-url max-width="1280">'
+                'https://66.media.tumblr.com/bench/tumblr_%s_%d_0_1280.png'
+                '</photo-url><photoset>%s</photoset></post>' % (
+                    10 ** 17 - n, posted.strftime('%a, %d %b %Y %H:%M:%S'),
+                    posted.timestamp(), n, blog, n, photos))
+
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<tumblr version="1.0"><posts start="%d" total="%d" '
+                'type="photo">%s</posts></tumblr>' % (
+                    start, self.config.posts, ''.join(posts)))
+        self.send_body(body.encode('utf-8'), 'text/xml; charset=utf-8')
+
+    def send_tigsource(self, query):
+        # index.php?topic=<topic>.<offset>, offsets past the end show the
+        # last page like the forum does
+        topic, _, offset = query.get('topic', '0.0').partition('.')
+        total = self.config.posts
+        offset = min(int(offset or 0), total - 1)
+        offset -= offset % TIG_POSTS_PER_PAGE
+
+        posts = []
+        for reply in range(offset, min(offset + TIG_POSTS_PER_PAGE, total)):
+            # Reply numbers grow with time, the newest reply is total - 1
+            posted = datetime.fromtimestamp(
+                self.config.post_time(total - 1 - reply))
+            header = '<b>Reply #%d on:</b>' % reply if reply else '<b>on:</b>'
+            images = ''.join(
+                '<br /><img src="https://i.imgur.com/t%s_%d_%d.png" />' % (
+                    topic, reply, i)
+                for i in range(self.config.images_per_post))
+            posts.append(
+                '<table><tr><td><div class="smalltext">&#171; %s %s &#187;'
+                '</div><hr /><div class="post">Reply %d%s</div></td></tr>'
+                '</table>' % (
+                    header,
+                    posted.strftime('%B %d, %Y, %I:%M:%S %p'), reply, images))
+
+        body = ('<html><body><table><tr><td id="top_subject">Topic: %s'
+                '</td></tr></table>%s</body></html>' % (
+                    html.escape('Benchmark topic ' + topic), ''.join(posts)))
+        self.send_body(body.encode('utf-8'), 'text/html; charset=UTF-8')